@@ -0,0 +1,168 @@
+from django.forms import CharField, Form
+from django.forms.formsets import formset_factory
+from collections import OrderedDict
+import copy
+
+from compound_forms.forms import (MergingCompoundForm, MergingCompoundModelForm,
+                                  compoundform_factory)
+from compound_forms.formsets import (CompoundFormSet, CompoundInlineFormSet,
+                                     compoundformset_factory)
+
+from app.models import Normal, NormalRelated, Other, OtherRelated
+from app.forms import NormalForm, OtherForm, NormalRelatedFormset, OtherRelatedFormset
+
+##############################################################################
+# Each case is a generator function taking benchmark parameters. It performs
+# any setup work, then yields the callable to measure.
+
+def post_data(form_or_set, value=u'value'):
+    """ Build request.POST-like data filling every field of a form or formset """
+    data = {}
+    if hasattr(form_or_set, 'management_form'):
+        data.update(post_data(form_or_set.management_form, value=None))
+        for form in form_or_set:
+            data.update(post_data(form, value))
+        return data
+    for field in form_or_set:
+        current = field.value()
+        data[field.html_name] = value if current in (None, '') else current
+    return data
+
+def subform_class(index, fields, linked, group=False):
+    """ A plain form with given number of fields, sharing linked fields with siblings """
+    attrs = OrderedDict(('field_%d' % i, CharField(max_length=255)) for i in range(fields))
+    attrs.update(('linked_%d' % i, CharField(max_length=255)) for i in range(linked))
+    if group:
+        attrs['key'] = CharField(max_length=255)
+    return type(str('SubForm%d' % index), (Form,), attrs)
+
+def compound_form_class(subforms, fields, linked):
+    return compoundform_factory(
+        OrderedDict(('form%d' % i, subform_class(i, fields, linked)) for i in range(subforms)),
+        base=MergingCompoundForm,
+        linked_fields=OrderedDict(('linked_%d' % i, CharField(max_length=255))
+                                  for i in range(linked)),
+    )
+
+def compound_formset_class(subforms, fields):
+    return compoundformset_factory(
+        OrderedDict(('formset%d' % i, formset_factory(subform_class(i, fields, 0, group=True),
+                                                      extra=1))
+                    for i in range(subforms)),
+        base=CompoundFormSet,
+        formset_group_fields=OrderedDict((('key', CharField(max_length=255)),)),
+    )
+
+##############################################################################
+
+def form_construct(subforms, fields, linked):
+    klass = compound_form_class(subforms, fields, linked)
+    yield lambda: klass()
+
+def form_validate(subforms, fields, linked):
+    klass = compound_form_class(subforms, fields, linked)
+    data = post_data(klass())
+    def run():
+        form = klass(data=data)
+        assert form.is_valid(), form.errors
+    yield run
+
+def form_render(subforms, fields, linked):
+    klass = compound_form_class(subforms, fields, linked)
+    yield lambda: klass().as_p()
+
+def formset_construct(subforms, fields, rows):
+    klass = compound_formset_class(subforms, fields)
+    initial = [{'key': u'key%d' % i} for i in range(rows)]
+    yield lambda: klass(initial=initial).forms
+
+def formset_validate(subforms, fields, rows):
+    klass = compound_formset_class(subforms, fields)
+    initial = [{'key': u'key%d' % i} for i in range(rows)]
+    data = post_data(klass(initial=initial))
+    def run():
+        formset = klass(initial=initial, data=data)
+        assert formset.is_valid(), formset.errors
+    yield run
+
+def formset_render(subforms, fields, rows):
+    klass = compound_formset_class(subforms, fields)
+    initial = [{'key': u'key%d' % i} for i in range(rows)]
+    yield lambda: klass(initial=initial).as_p()
+
+##############################################################################
+# Saving uses test_project models
+
+def form_save():
+    klass = compoundform_factory(
+        OrderedDict((('normal', NormalForm), ('other', OtherForm))),
+        base=MergingCompoundModelForm,
+    )
+    instances = {
+        'normal': Normal.objects.create(common=u'common', field_a=u'normal'),
+        'other': Other.objects.create(common=u'common', field_a=u'other'),
+    }
+    data = post_data(klass(instances=instances))
+    data['normal-field_a'] = data['other-field_a'] = u'updated'
+    def run():
+        # validation updates instances in place, give each run its own
+        form = klass(instances=dict((name, copy.copy(instance))
+                                    for name, instance in instances.items()),
+                     data=data)
+        assert form.is_valid(), form.errors
+        form.save()
+    yield run
+    Normal.objects.all().delete()
+    Other.objects.all().delete()
+
+def formset_save(rows):
+    klass = compoundformset_factory(
+        OrderedDict((('normalrel', NormalRelatedFormset), ('otherrel', OtherRelatedFormset))),
+        base=CompoundInlineFormSet,
+        formset_group_fields=OrderedDict((('common', CharField(max_length=255)),)),
+    )
+    instances = {
+        'normalrel': Normal.objects.create(common=u'common', field_a=u'normal'),
+        'otherrel': Other.objects.create(common=u'common', field_a=u'other'),
+    }
+    NormalRelated.objects.bulk_create([
+        NormalRelated(common=u'common%d' % i, field_a=u'normal%d' % i,
+                      normal=instances['normalrel'])
+        for i in range(rows)
+    ])
+    OtherRelated.objects.bulk_create([
+        OtherRelated(common=u'common%d' % i, field_a=u'other%d' % i,
+                     other=instances['otherrel'])
+        for i in range(rows)
+    ])
+    formset = klass(instances=instances)
+    data = post_data(formset)
+    for index in range(rows):
+        data['%s-field_a' % formset.forms[index].forms['normalrel'].prefix] = u'updated'
+    def run():
+        formset = klass(instances=instances, data=data)
+        assert formset.is_valid(), formset.errors
+        formset.save()
+    yield run
+    for model in (NormalRelated, OtherRelated, Normal, Other):
+        model.objects.all().delete()
+
+##############################################################################
+
+def cases(subforms, fields, linked, rows):
+    """ Yield (name, params, case function) for all combinations of parameters """
+    for function in (form_construct, form_validate, form_render):
+        for s in subforms:
+            for f in fields:
+                for l in linked:
+                    yield (function.__name__, OrderedDict((('subforms', s), ('fields', f),
+                                                           ('linked', l))), function)
+    for function in (formset_construct, formset_validate, formset_render):
+        for s in subforms:
+            for f in fields:
+                for r in rows:
+                    yield (function.__name__, OrderedDict((('subforms', s), ('fields', f),
+                                                           ('rows', r))), function)
+    yield (form_save.__name__, OrderedDict(), form_save)
+    for r in rows:
+        yield (formset_save.__name__, OrderedDict((('rows', r),)), formset_save)
@@ -0,0 +1,71 @@
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from collections import OrderedDict
+from timeit import default_timer
+import gc
+try:
+    import tracemalloc
+except ImportError:     # python < 3.4, allocations are not measured
+    tracemalloc = None
+
+##############################################################################
+
+class Rollback(Exception):
+    """ Raised to roll back database changes made by a measured call """
+
+def call(function, queries=None):
+    """ Call function, rolling back any changes it makes to the database """
+    try:
+        with transaction.atomic():
+            if queries is None:
+                function()
+            else:   # only count queries made by the function itself
+                with queries:
+                    function()
+            raise Rollback()
+    except Rollback:
+        pass
+
+def measure(function, repeat):
+    """ Measure a callable, returning a dict of statistics """
+    call(function)  # warm up caches, both python's and django's
+
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = default_timer()
+        call(function)
+        times.append(default_timer() - start)
+    times.sort()
+
+    reset_queries()
+    queries = CaptureQueriesContext(connection)
+    call(function, queries)
+    result = OrderedDict((
+        ('time_min', times[0]),
+        ('time_median', times[len(times) // 2]),
+        ('queries', len(queries)),
+        ('alloc_blocks', None),
+        ('alloc_peak', None),
+    ))
+    reset_queries()
+
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        call(function)
+        after = tracemalloc.take_snapshot()
+        result['alloc_peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        result['alloc_blocks'] = sum(stat.count_diff for stat in after.compare_to(before, 'filename')
+                                     if stat.count_diff > 0)
+    return result
+
+def run_case(function, params, repeat):
+    """ Run a case generator: setup, measure then teardown """
+    steps = function(**params)
+    result = measure(next(steps), repeat)
+    for _ in steps:     # run teardown
+        pass
+    return result
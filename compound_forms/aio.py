@@ -0,0 +1,118 @@
+""" Coroutine API for compound forms and formsets, requires python 3.5 """
+from django.db import close_old_connections, transaction
+import asyncio
+import functools
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    sync_to_async = None
+
+from .signals import timed
+
+##############################################################################
+
+def to_thread(function, *args, **kwargs):
+    """ Run a blocking call out of the event loop, returning an awaitable
+
+        With asgiref, the call is run by the thread it reserves for
+        thread-sensitive code, as the ORM expects. Otherwise, it is run by
+        the loop's default executor, closing database connections it opened.
+    """
+    if sync_to_async is not None:
+        return sync_to_async(function, thread_sensitive=True)(*args, **kwargs)
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, functools.partial(closing_connections,
+                                                        function, *args, **kwargs))
+
+def to_worker(executor, function, *args, **kwargs):
+    """ Run a blocking call concurrently with others, returning an awaitable
+
+        The call is submitted to executor if given, which owns connections
+        opened by its threads, as with validation_executor. Otherwise, it is
+        run by a worker thread of asgiref or of the loop's default executor,
+        closing database connections it opened.
+    """
+    if executor is not None:
+        return asyncio.wrap_future(executor.submit(function, *args, **kwargs))
+    if sync_to_async is not None:
+        return sync_to_async(closing_connections, thread_sensitive=False)(
+            function, *args, **kwargs)
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, functools.partial(closing_connections,
+                                                        function, *args, **kwargs))
+
+def closing_connections(function, *args, **kwargs):
+    """ Call function, then close database connections as at the end of a request """
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+def atomic_call(function, *args, **kwargs):
+    """ Call function in a transaction """
+    with transaction.atomic():
+        return function(*args, **kwargs)
+
+##############################################################################
+
+class AsyncSubFormsMixin(object):
+    """ Adds ais_valid() and asave() coroutines to compound model forms """
+    async def ais_valid(self):
+        """ Like is_valid(), without blocking the event loop
+
+            Subforms are cleaned concurrently, by validation_executor if set.
+        """
+        if self.is_bound and self._errors is None:
+            executor = getattr(self, 'validation_executor', None)
+            pending = await to_thread(self._pending_forms)
+            await asyncio.gather(*(to_worker(executor, timed, self, 'full_clean', name,
+                                             form.full_clean)
+                                   for name, form in pending))
+        return await to_thread(self.is_valid)
+
+    def _pending_forms(self):
+        """ Prepare cleaning, returning (name, form) pairs of subforms to clean """
+        self._prepare_clean()
+        return [(name, form) for name, form in self._built_forms().items()
+                if form.is_bound and form._errors is None]
+
+    async def asave(self, only=None, **kwargs):
+        """ Like save(), without blocking the event loop
+
+            Subforms are saved by a single blocking call, in one transaction.
+        """
+        return await to_thread(atomic_call, self.save, only=only, **kwargs)
+
+##############################################################################
+
+class AsyncSubFormSetsMixin(object):
+    """ Adds ais_valid() and asave() coroutines to compound formsets """
+    # Executor used by ais_valid() to clean sub-formsets, see
+    # MergingFormMixin.validation_executor
+    validation_executor = None
+
+    async def ais_valid(self):
+        """ Like is_valid(), without blocking the event loop
+
+            Rows are built first, then sub-formsets are cleaned concurrently,
+            by validation_executor if set.
+        """
+        if self.is_bound and self._errors is None:
+            formsets = await to_thread(self._pending_formsets)
+            await asyncio.gather(*(to_worker(self.validation_executor, timed, self,
+                                             'full_clean', name, getattr, formset, 'errors')
+                                   for name, formset in formsets))
+        return await to_thread(self.is_valid)
+
+    def _pending_formsets(self):
+        """ Build and prepare rows for cleaning, returning (name, sub-formset) pairs """
+        self._prepare_clean()
+        return list(self.formsets.items())
+
+    async def asave(self, only=None, **kwargs):
+        """ Like save(), without blocking the event loop
+
+            Sub-formsets are saved by a single blocking call, in one transaction,
+            so rows are never half-saved.
+        """
+        return await to_thread(atomic_call, self.save, only=only, **kwargs)
@@ -0,0 +1,169 @@
+from django.utils.datastructures import MultiValueDict
+from collections import OrderedDict
+import copy
+import sys
+import threading
+try:
+    from collections.abc import Mapping
+except ImportError:     # python 2
+    from collections import Mapping
+
+##############################################################################
+
+class OverlayDict(MultiValueDict):
+    """ Read-through view of form data, with some keys overridden
+
+        Written values are kept in the overlay itself, lookups of other keys
+        fall through to the wrapped data, which is shared and never copied.
+    """
+    def __init__(self, data, key_to_list_mapping=()):
+        super(OverlayDict, self).__init__(key_to_list_mapping)
+        self.data = data
+
+    def __repr__(self):
+        return '<%s: %r over %r>' % (self.__class__.__name__,
+                                     dict(self._iterownlists()), self.data)
+
+    def __reduce__(self):
+        return (self.__class__, (self.data, list(self._iterownlists())))
+
+    def __getitem__(self, key):
+        if dict.__contains__(self, key):
+            return super(OverlayDict, self).__getitem__(key)
+        return self.data[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.data
+
+    def __iter__(self):
+        for key in dict.__iter__(self):
+            yield key
+        for key in self.data:
+            if not dict.__contains__(self, key):
+                yield key
+
+    def __len__(self):
+        return dict.__len__(self) + sum(1 for key in self.data
+                                        if not dict.__contains__(self, key))
+
+    def __copy__(self):
+        return MultiValueDict([(key, list(values)) for key, values in self._iterlists()])
+
+    def __deepcopy__(self, memo=None):
+        return MultiValueDict(copy.deepcopy(list(self._iterlists()), memo))
+
+    def getlist(self, key, default=None):
+        if dict.__contains__(self, key):
+            return list(dict.__getitem__(self, key))
+        if hasattr(self.data, 'getlist'):
+            return list(self.data.getlist(key, default))
+        try:
+            value = self.data[key]
+        except KeyError:
+            return [] if default is None else default
+        return list(value) if isinstance(value, list) else [value]
+
+    def setlistdefault(self, key, default_list=None):
+        """ Overlaid list of key, copied from the wrapped data if it has the key """
+        if not dict.__contains__(self, key):
+            if key in self.data:
+                default_list = self.getlist(key)
+            self.setlist(key, [] if default_list is None else default_list)
+        return dict.__getitem__(self, key)
+
+    def _iterownlists(self):
+        return ((key, dict.__getitem__(self, key)) for key in dict.__iter__(self))
+
+    def _iterlists(self):
+        for item in self._iterownlists():
+            yield item
+        for key in self.data:
+            if not dict.__contains__(self, key):
+                yield key, self.getlist(key)
+
+    def keys(self):
+        return list(self)
+
+    if sys.version_info[0] >= 3:
+        lists = _iterlists
+    else:
+        iterlists = _iterlists
+        iterkeys = __iter__
+
+        def lists(self):
+            return list(self._iterlists())
+
+##############################################################################
+
+class LazyOrderedDict(Mapping):
+    """ Ordered mapping with a fixed set of keys, building values on first access """
+    def __init__(self, keys, factory):
+        self._keys = tuple(keys)
+        self._keyset = frozenset(self._keys)
+        self._factory = factory
+        self._values = {}
+
+    def __repr__(self):
+        return '<%s: %r>' % (self.__class__.__name__, self._keys)
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            if key not in self._keyset:
+                raise
+        value = self._values[key] = self._factory(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self._keyset
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def is_built(self, key):
+        """ Whether the value for key was built already """
+        return key in self._values
+
+    def built(self):
+        """ Dict of key: value for values built so far, in key order """
+        return OrderedDict((key, self._values[key])
+                           for key in self._keys if key in self._values)
+
+##############################################################################
+
+class LRUCache(object):
+    """ Thread-safe mapping holding at most maxsize items, dropping least recently used """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value     # move to most recently used end
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -1,24 +1,112 @@
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.db import connections, router, transaction
 from django.forms import Form, ModelForm
+from django.forms.fields import ChoiceField, Field
+from django.forms.widgets import Select, Widget
 from django.forms.forms import BaseForm, NON_FIELD_ERRORS
 from django.utils.functional import cached_property
+try:
+    from django.forms.utils import ErrorDict
+except ImportError:     # django < 1.7
+    from django.forms.util import ErrorDict
 from collections import OrderedDict
 import copy
+import itertools
+import sys
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:     # python 2
+    from collections import Mapping, MutableMapping
+
+from .datastructures import LazyOrderedDict, LRUCache, OverlayDict
+from .signals import timed
+
+if sys.version_info >= (3, 5):
+    from .aio import AsyncSubFormsMixin
+else:
+    class AsyncSubFormsMixin(object):
+        """ Coroutine API requires python 3.5 """
 
 ##############################################################################
 
+def _deepcopy_owner(klass):
+    """ Class defining the __deepcopy__ that klass uses """
+    for base in klass.__mro__:
+        if '__deepcopy__' in base.__dict__:
+            return base
+
+_CLONEABLE_FIELDS = (Field, ChoiceField)
+_CLONEABLE_WIDGETS = tuple(set(_deepcopy_owner(klass) for klass in (Widget, Select)))
+_cloneable = {}     # class: whether clone_field knows what its deepcopy does
+
+def _is_cloneable(klass, owners):
+    try:
+        return _cloneable[klass]
+    except KeyError:
+        result = _cloneable[klass] = _deepcopy_owner(klass) in owners
+        return result
+
+def clone_field(field):
+    """ Cheap copy.deepcopy of a field, only copying per-instance mutable state
+
+        Validators, choices and widget attributes are copied shallowly, so
+        each clone can be altered without affecting others. Fields and widgets
+        with their own __deepcopy__, such as ModelChoiceField or MultiWidget,
+        are deep-copied.
+    """
+    widget = field.widget
+    if not (_is_cloneable(type(field), _CLONEABLE_FIELDS) and
+            _is_cloneable(type(widget), _CLONEABLE_WIDGETS)):
+        return copy.deepcopy(field)
+    result = copy.copy(field)
+    result.widget = copy.copy(widget)
+    result.widget.attrs = widget.attrs.copy()
+    result.validators = field.validators[:]
+    if isinstance(field, ChoiceField):
+        result._choices = copy.copy(field._choices)
+    if hasattr(widget, 'choices'):
+        if isinstance(field, ChoiceField) and widget.choices is field._choices:
+            result.widget.choices = result._choices
+        else:
+            result.widget.choices = copy.copy(widget.choices)
+    return result
+
+
+def clean_from_initial(form):
+    """ Mark a form as valid without cleaning it, using initial values as cleaned_data
+
+        Initial values are used as is: model choice fields hold primary keys
+        rather than model instances, for instance.
+    """
+    form._errors = ErrorDict()
+    form.cleaned_data = {}
+    for name, field in form.fields.items():
+        value = form.initial.get(name, field.initial)
+        form.cleaned_data[name] = value() if callable(value) else value
+
+
 class SubFormsProxyMixin(BaseForm):
     """ Base form that handles sub-forms with optional linked fields """
     linked_fields = OrderedDict()
+    # Names of subforms that are not cleaned, nor saved, when their data
+    # did not change from their initial values
+    skip_unchanged_forms = ()
+    # Reuse merged media of forms with the same classes and widgets. Only
+    # enable if no form or widget media depends on instance or request state
+    cache_media = False
+    # Check linked field initial values agree amongst subforms, or use the first one
+    check_linked_initials = True
 
     def __init__(self, *args, **kwargs):
         pull_linked_fields = kwargs.pop('pull_linked_fields', True)
         super(SubFormsProxyMixin, self).__init__(*args, **kwargs)
+        self.skipped_forms = set()
         for name, field in self.linked_fields.items():
             if field is not None:
                 # as it can be modified, each form must have it own field instance
-                self.fields[name] = copy.deepcopy(field)
-        if pull_linked_fields:
-            self.pull_linked_fields()
+                self.fields[name] = clone_field(field)
+        if pull_linked_fields and not self.is_bound:
+            timed(self, 'pull_linked_fields', None, self.pull_linked_fields)
 
     def pull_linked_fields(self):
         """ Pull initial values from sub-forms (and checks they are identical) """
@@ -28,51 +116,154 @@ class SubFormsProxyMixin(BaseForm):
                     continue             # specified, simply use it
                 if name not in self.fields:  # field will be added by add_field
                     continue                 # on some formset, just skip pulling it
-                initials = tuple(
-                    form.initial.get(name, form.fields[name].initial)
-                    for form in self.forms.values()
-                    if name in form.fields
-                )
-                if initials.count(initials[0]) != len(initials):
-                    raise ValueError('Initial sub-form values differ for '
-                                     'linked field %s: %r' % (name, initials))
-                self.initial[name] = initials[0]
+                first = None
+                for form_name, form in self._linked_forms(name):
+                    value = form.initial.get(name, form.fields[name].initial)
+                    if first is None:
+                        first = (form_name, value)
+                        if not self.check_linked_initials:
+                            break
+                    elif value != first[1]:
+                        raise ValueError('Initial sub-form values differ for linked field '
+                                         '%s: %r in %s, %r in %s' %
+                                         (name, first[1], first[0], value, form_name))
+                if first is not None:
+                    self.initial[name] = first[1]
 
     def push_linked_fields(self):
         """ Push raw field data to sub-forms and let them do the cleaning later """
         if self.is_bound:
-            for form in self.forms.values():
-                form.data = form.data.copy() # we need a mutable copy
-                form.data.update(dict(
-                    (form.add_prefix(name), self._raw_value(name))
-                    for name in self.linked_fields.keys()
-                    if name in form.fields
-                ))
+            self._linked_pushed = True
+            for form in self._built_forms().values():
+                self._push_linked_form(form)
+
+    def _push_linked_form(self, form):
+        if not form.is_bound:
+            return
+        values = [(form.add_prefix(name), self._raw_value(name))
+                  for name in self.linked_fields.keys()
+                  if name in form.fields]
+        if values:
+            if not isinstance(form.data, OverlayDict):
+                form.data = OverlayDict(form.data) # shares the payload, no copy
+            for key, value in values:
+                form.data.setlist(key, value if isinstance(value, list) else [value])
 
     def full_clean(self):
         """ Hook field data pushing before form cleaning kicks in """
         if self.is_bound:
-            self.push_linked_fields()
+            self._prepare_clean()
         super(SubFormsProxyMixin, self).full_clean()
 
+    def _prepare_clean(self):
+        """ Push linked values and skip unchanged subforms, before cleaning """
+        timed(self, 'push_linked_fields', None, self.push_linked_fields)
+        for name, form in self._built_forms().items():
+            self._skip_unchanged_form(name, form)
+
+    def skip_form(self, name, form=None):
+        """ Consider subform valid with its initial data, without cleaning nor saving it """
+        clean_from_initial(self.forms[name] if form is None else form)
+        self.skipped_forms.add(name)
+
+    def _skip_unchanged_form(self, name, form):
+        if (name in self.skip_unchanged_forms and name not in self.skipped_forms and
+            form.is_bound and form._errors is None and not form.has_changed()):
+            self.skip_form(name, form)
+
     @property
     def media(self):
-        return (super(SubFormsProxyMixin, self).media +
-                sum(form.media for form in self.forms.values()))
+        if not self.cache_media:
+            return self._merge_media()
+        key = (type(self), self._media_key(self),
+               tuple((type(form), self._media_key(form)) for form in self.forms.values()))
+        media = media_cache.get(key)
+        if media is None:
+            media = self._merge_media()
+            media_cache.set(key, media)
+        return media
+
+    def _merge_media(self):
+        """ Media of self and all subforms, each asset appearing once """
+        return sum((form.media for form in self.forms.values()),
+                   super(SubFormsProxyMixin, self).media)
+
+    @staticmethod
+    def _media_key(form):
+        """ Widget classes of a form, which along with its class determine its media """
+        return tuple(type(field.widget) for field in form.fields.values())
 
     def is_multipart(self):
         return (super(SubFormsProxyMixin, self).is_multipart() or
                 any(form.is_multipart() for form in self.forms.values()))
 
+    def _built_forms(self):
+        """ Dict of name: form for subforms constructed so far """
+        return self.forms.built() if hasattr(self.forms, 'built') else self.forms
+
+    def _linked_forms(self, name):
+        """ (name, form) pairs of subforms sharing linked field name """
+        return ((form_name, form) for form_name, form in self.forms.items()
+                if name in form.fields)
+
+    @classmethod
+    def _static_form_fields(cls):
+        """ Dict of name: field names of each subform, if known from the class """
+        return None
+
 ##############################################################################
 
 class SubFormsBuildMixin(BaseForm):
     form_classes = OrderedDict()
+    lazy_forms = False      # only construct subforms when first accessed
+    # What to do with subforms that have no key in submitted data:
+    # None binds them anyway, 'unbound' leaves them unbound, 'skip' omits them
+    partial_binding = None
 
     @cached_property
     def forms(self):
         """ Dict of name: form """
-        return OrderedDict((name, self._construct_form(name)) for name in self.form_classes.keys())
+        if self.partial_binding not in (None, 'unbound', 'skip'):
+            raise ValueError('Invalid partial_binding %r' % (self.partial_binding,))
+        names = self.form_classes.keys()
+        if self.is_bound and self.partial_binding == 'skip':
+            names = [name for name in names if self._is_submitted(name)]
+        if self.lazy_forms:
+            return LazyOrderedDict(names, self._construct_lazy_form)
+        return OrderedDict((name, timed(self, 'construct_form', name, self._construct_form, name))
+                           for name in names)
+
+    @cached_property
+    def _submitted_prefixes(self):
+        """ Set of all prefixes of submitted data and files keys """
+        prefixes = set()
+        for key in itertools.chain(self.data, self.files):
+            index = key.find('-')
+            while index != -1:
+                prefixes.add(key[:index])
+                index = key.find('-', index + 1)
+        return prefixes
+
+    def _is_submitted(self, name):
+        """ Whether submitted data has any key for given subform """
+        return self.add_prefix(name) in self._submitted_prefixes
+
+    def _construct_lazy_form(self, name):
+        form = timed(self, 'construct_form', name, self._construct_form, name)
+        if getattr(self, '_linked_pushed', False): # built after pushing linked fields
+            self._push_linked_form(form)
+            self._skip_unchanged_form(name, form)
+        return form
+
+    def _linked_forms(self, name):
+        if not self.lazy_forms:
+            return super(SubFormsBuildMixin, self)._linked_forms(name)
+        # do not construct subforms that do not declare the field
+        forms = self.forms
+        return ((form_name, forms[form_name]) for form_name in forms
+                if (forms.is_built(form_name) or
+                    name in self.form_classes[form_name].base_fields)
+                and name in forms[form_name].fields)
 
     def _construct_form(self, name, **kwargs):
         klass = self.form_classes[name]
@@ -81,7 +272,7 @@ class SubFormsBuildMixin(BaseForm):
             'prefix': self.add_prefix(name),
             'error_class': self.error_class,
         }
-        if self.is_bound:
+        if self.is_bound and (self.partial_binding is None or self._is_submitted(name)):
             defaults['data'] = self.data
             defaults['files'] = self.files
         if self.initial and not 'initial' in kwargs:
@@ -92,13 +283,92 @@ class SubFormsBuildMixin(BaseForm):
         defaults.update(kwargs)
         return klass(**defaults)
 
+    @classmethod
+    def _static_form_fields(cls):
+        return OrderedDict((name, tuple(klass.base_fields))
+                           for name, klass in cls.form_classes.items())
+
 ##############################################################################
 
-class ModelSubFormsMixin(BaseForm):
+def save_instances(instances):
+    """ Save model instances, grouping queries per model where the database allows it
+
+        Grouped queries do not call save() nor send model signals. Each model
+        falls back to saving instances one by one when its database cannot
+        return primary keys from bulk inserts, or if bulk_update is missing.
+    """
+    by_model = OrderedDict()
+    for instance in instances:
+        existing, new = by_model.setdefault(type(instance), ([], []))
+        (new if instance._state.adding else existing).append(instance)
+
+    for model, (existing, new) in by_model.items():
+        manager = model._default_manager
+        if len(existing) > 1 and hasattr(manager, 'bulk_update'):
+            manager.bulk_update(existing, [field.name for field in model._meta.concrete_fields
+                                           if not field.primary_key])
+        else:
+            for instance in existing:
+                instance.save()
+
+        features = connections[router.db_for_write(model)].features
+        if (len(new) > 1 and not model._meta.parents and
+            (getattr(features, 'can_return_rows_from_bulk_insert', False) or
+             getattr(features, 'can_return_ids_from_bulk_insert', False))):
+            manager.bulk_create(new)
+        else:
+            for instance in new:
+                instance.save()
+
+
+def _follow_relation(obj, path):
+    """ Object reached from obj through a lookup path, or None if there is none """
+    for attname in path.split('__') if path else ():
+        try:
+            obj = getattr(obj, attname)
+        except ObjectDoesNotExist:  # missing reverse one-to-one
+            return None
+        if obj is None:
+            return None
+    return obj
+
+
+class ModelSubFormsMixin(AsyncSubFormsMixin, BaseForm):
+    # Model of root objects given to load_instances()
+    root_model = None
+    # Dict of form name: lookup path from a root object to the form's instance,
+    # such as 'profile__address'. An empty path is the root object itself.
+    instance_relations = {}
+
     def __init__(self, *args, **kwargs):
         self.instances = kwargs.pop('instances', {})
         super(ModelSubFormsMixin, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def load_instances(cls, root):
+        """ Load subform instances from a root object or primary key
+
+            Relations in instance_relations are followed through a single
+            select_related() query, so they must be forward or one-to-one
+            relations. Forms whose related object does not exist are left
+            out. Returns a (dict of form name: instance, query count) tuple.
+        """
+        if cls.root_model is None:
+            raise ImproperlyConfigured('%s.root_model must be set to load instances' %
+                                       cls.__name__)
+        paths = [path for path in cls.instance_relations.values() if path]
+        query_count = 0
+        if paths or not isinstance(root, cls.root_model):
+            pk = root.pk if isinstance(root, cls.root_model) else root
+            root = cls.root_model._default_manager.select_related(*paths).get(pk=pk)
+            query_count = 1
+        instances = {}
+        for name, path in cls.instance_relations.items():
+            instance = _follow_relation(root, path)
+            if instance is not None:
+                instances[name] = instance
+        return instances, query_count
+
     def _construct_form(self, name, **kwargs):
         defaults = {
             'instance': self.instances.get(name),
@@ -106,46 +376,381 @@ class ModelSubFormsMixin(BaseForm):
         defaults.update(kwargs)
         return super(ModelSubFormsMixin, self)._construct_form(name, **defaults)
 
-    def save(self, only=None, **kwargs):
-        keys = self.forms.keys() if only is None else only
-        return OrderedDict((name, self._save_form(name, **kwargs)) for name in keys)
+    def save(self, only=None, bulk=False, **kwargs):
+        """ Save subforms, by default all that were constructed
+
+            With bulk set, all subforms are saved in a single transaction,
+            grouping queries per model through save_instances().
+        """
+        keys = self._saved_form_names() if only is None else only
+        if not bulk or not kwargs.get('commit', True):
+            return OrderedDict((name, self._save_form(name, **kwargs)) for name in keys)
+
+        kwargs['commit'] = False
+        with transaction.atomic():
+            result = OrderedDict((name, self._save_form(name, **kwargs)) for name in keys)
+            saved = [name for name in keys if name not in self.skipped_forms]
+            save_instances(result[name] for name in saved)
+            for name in saved:
+                self.forms[name].save_m2m()
+        return result
+
+    def _saved_form_names(self):
+        """ Names of subforms saved by default: constructed ones, bound if self is """
+        return [name for name, form in self._built_forms().items()
+                if form.is_bound or not self.is_bound]
 
     def _save_form(self, name, **kwargs):
-        return self.forms[name].save(**kwargs)
+        if name in self.skipped_forms:
+            return self.forms[name].instance
+        return timed(self, 'save', name, self.forms[name].save, **kwargs)
 
 ##############################################################################
 
+class FieldLayout(object):
+    """ Alias table of a merging form, mapping each alias to its subform field """
+    def __init__(self, form_fields, linked_fields, get_alias):
+        self.form_fields = OrderedDict()    # form name: tuple of field names
+        self.aliases = OrderedDict()        # alias: (form name, field name)
+        for form_name, field_names in form_fields.items():
+            self.form_fields[form_name] = tuple(field_names)
+            self.aliases.update((get_alias(form_name, field_name), (form_name, field_name))
+                                for field_name in field_names
+                                if field_name not in linked_fields)
+
+    def matches(self, form_name, form):
+        """ Whether the layout applies to this subform instance """
+        return self.form_fields.get(form_name) == tuple(form.fields)
+
+    def matches_all(self, forms):
+        """ Whether the layout applies to all subforms of a form, and only them """
+        return (len(forms) == len(self.form_fields) and
+                all(self.matches(form_name, form) for form_name, form in forms.items()))
+
+
+class LayoutFieldForms(Mapping):
+    """ Read-only alias: (form, field name) mapping, resolving aliases through a layout
+
+        Holds no per-alias data, so forms sharing a layout, such as the rows
+        of a compound formset, only have their subforms to keep.
+    """
+    __slots__ = ('aliases', 'forms')
+
+    def __init__(self, layout, forms):
+        self.aliases = layout.aliases
+        self.forms = forms
+
+    def __getitem__(self, alias):
+        form_name, field_name = self.aliases[alias]
+        return self.forms[form_name], field_name
+
+    def __contains__(self, alias):
+        return alias in self.aliases
+
+    def __iter__(self):
+        return iter(self.aliases)
+
+    def __len__(self):
+        return len(self.aliases)
+
+
+def _merge_error_lists(lists):
+    """ Concatenate error lists into a new one like the first, dropping duplicate messages """
+    merged = type(lists[0])()
+    if hasattr(lists[0], 'error_class'):    # django >= 1.7
+        merged.error_class = lists[0].error_class
+    seen = set()
+    for errors in lists:
+        for message, item in zip(errors, getattr(errors, 'data', errors)):
+            if message not in seen:
+                seen.add(message)
+                merged.append(item)
+    return merged
+
+
+class MergedErrorDict(ErrorDict):
+    """ Errors of a merging form: its own, and its subforms' under alias names
+
+        Subform errors are only looked up when accessed by key, or tested
+        for emptiness, as is_valid() does. Reading the whole mapping stores
+        all merged errors in the dict itself, so code handling it as a
+        plain dict, such as json.dumps(), sees them all. Errors are returned
+        as lists of the merging form, so adding to them leaves subform
+        errors untouched.
+    """
+    def __init__(self, errors, form):
+        super(MergedErrorDict, self).__init__(errors)
+        self.form = form
+        self._merged = {}
+        self._order = None      # key order once materialized
+
+    def _subforms(self):
+        return [(form_name, form) for form_name, form in self.form.forms.items()
+                if form._errors]
+
+    def _lists(self, key):
+        """ Error lists for key, own first then in subform order """
+        own = dict.get(self, key)
+        if own is not None:
+            yield own
+        if key == NON_FIELD_ERRORS or key in self.form.linked_fields:
+            for form_name, form in self._subforms():
+                if key in form._errors:
+                    yield form._errors[key]
+        elif key in self.form.field_form:
+            form, field_name = self.form.field_form[key]
+            if form._errors and field_name in form._errors:
+                yield form._errors[field_name]
+
+    def _keys(self):
+        """ Own keys, then subform keys under alias names """
+        seen = set()
+        for key in dict.__iter__(self):
+            seen.add(key)
+            yield key
+        for form_name, form in self._subforms():
+            for field_name in form._errors:
+                key = (field_name if field_name == NON_FIELD_ERRORS else
+                       self.form._get_alias(form_name, field_name))
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def materialize(self):
+        """ Store all merged errors in the dict itself """
+        if self._order is None:
+            timed(self.form, 'merge_errors', None, self._store_merged)
+        return self
+
+    def _store_merged(self):
+        order = list(self._keys())
+        for key in order:
+            dict.__setitem__(self, key, self[key])
+        self._order = order
+        self._merged.clear()
+
+    def __getitem__(self, key):
+        if self._order is not None:
+            return dict.__getitem__(self, key)
+        try:
+            return self._merged[key]
+        except KeyError:
+            pass
+        lists = list(self._lists(key))
+        if not lists:
+            raise KeyError(key)
+        if len(lists) == 1 and lists[0] is dict.get(self, key):
+            return lists[0]
+        merged = self._merged[key] = _merge_error_lists(lists)
+        return merged
+
+    def __setitem__(self, key, value):
+        self._merged.pop(key, None)
+        super(MergedErrorDict, self).__setitem__(key, value)
+
+    def __contains__(self, key):
+        if self._order is not None:
+            return dict.__contains__(self, key)
+        return next(self._lists(key), None) is not None
+
+    def __iter__(self):
+        self.materialize()
+        order = set(self._order)
+        return itertools.chain((key for key in self._order if dict.__contains__(self, key)),
+                               (key for key in dict.keys(self) if key not in order))
+
+    def __len__(self):
+        return dict.__len__(self.materialize())
+
+    def __bool__(self):
+        if self._order is not None:
+            return dict.__len__(self) > 0
+        return dict.__len__(self) > 0 or any(form._errors for form in self.form.forms.values())
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return dict.__eq__(self.materialize(), other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    iterkeys = __iter__     # python 2
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def copy(self):
+        return ErrorDict(self.items())
+
+
+class MergedCleanedData(MutableMapping):
+    """ Cleaned data of a merging form: its own, and its subforms' under alias names
+
+        Subform values are read from their cleaned_data when accessed, never
+        copied. Written values are kept in the form's own data, and deleted
+        aliases are hidden. Use dict(cleaned_data) or copy() to get a dict.
+    """
+    def __init__(self, data, form):
+        self.data = data
+        self.form = form
+        self.deleted = set()
+
+    def _lookup(self, key):
+        """ (subform cleaned_data, field name) holding key's value """
+        if key in self.deleted or key not in self.form.field_form:
+            raise KeyError(key)
+        form, field_name = self.form.field_form[key]
+        cleaned_data = getattr(form, 'cleaned_data', None)
+        if cleaned_data is None or field_name not in cleaned_data:
+            raise KeyError(key)
+        return cleaned_data, field_name
+
+    def __getitem__(self, key):
+        try:
+            return self.data[key]
+        except KeyError:
+            cleaned_data, field_name = self._lookup(key)
+            return cleaned_data[field_name]
+
+    def __contains__(self, key):
+        if key in self.data:
+            return True
+        try:
+            self._lookup(key)
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key, value):
+        self.deleted.discard(key)
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.data.pop(key, None)
+        self.deleted.add(key)
+
+    def __iter__(self):
+        for key in self.data:
+            yield key
+        for alias in self.form.field_form:
+            if alias not in self.data and alias in self:
+                yield alias
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def copy(self):
+        """ Plain dict of all cleaned data """
+        return dict(self.items())
+
+
 class MergingFormMixin(BaseForm):
     """ A BaseCompoundForm that allows access to subforms through field aliases """
+    # Executor used to clean subforms concurrently, such as a
+    # concurrent.futures.ThreadPoolExecutor. Database connections opened by
+    # validators in worker threads are left for the executor's owner to close.
+    validation_executor = None
+
     def __init__(self, *args, **kwargs):
+        if 'validation_executor' in kwargs:
+            self.validation_executor = kwargs.pop('validation_executor')
+        layout = kwargs.pop('field_layout', None)    # shared with similar forms
         super(MergingFormMixin, self).__init__(*args, **kwargs)
-        self.field_form = {}
-        self._make_field_aliases()
-
-    def _make_field_aliases(self):
-        for form_name, form in self.forms.items():
-            for field_name, field in form.fields.items():
-                if field_name in self.linked_fields:
-                    continue
-                alias = self._get_alias(form_name, field_name)
-                self.fields[alias] = field
-                self.field_form[alias] = (form, field_name)
+        self._make_field_aliases(self._get_field_layout() if layout is None else layout)
+
+    def _make_field_aliases(self, layout):
+        if layout is None or not layout.matches_all(self.forms):
+            # no layout from class, or subform fields changed at runtime
+            layout = self.make_field_layout()
+        self.field_layout = layout
+        self.field_form = LayoutFieldForms(layout, self.forms)
+        for alias, (form_name, field_name) in layout.aliases.items():
+            self.fields[alias] = self.forms[form_name].fields[field_name]
+        self.reset_own_fields()
+
+    def make_field_layout(self):
+        """ Alias layout of current subforms, to share with forms having similar subforms """
+        return FieldLayout(OrderedDict((form_name, tuple(form.fields))
+                                       for form_name, form in self.forms.items()),
+                           self.linked_fields, self._get_alias)
+
+    def _get_field_layout(self):
+        """ Alias layout shared by all instances, compiled once per class """
+        cls = type(self)
+        layout = cls.__dict__.get('_field_layout')
+        if layout is None:
+            form_fields = cls._static_form_fields()
+            if form_fields is None:
+                return None
+            layout = FieldLayout(form_fields, self.linked_fields, self._get_alias)
+            cls._field_layout = layout
+        return layout
 
     def _construct_form(self, name, **kwargs):
         defaults = {}
         if 'initial' in kwargs: # extract initial for this form
-            initial = {}
-            for key, value in kwargs['initial'].items():
-                try:
-                    form_name, field_name = key.split('.')
-                except ValueError:
-                    continue
-                if form_name == name and field_name not in self.linked_fields:
-                    initial[field_name] = value
-            defaults['initial'] = initial
+            defaults['initial'] = self._partition_initial(kwargs['initial']).get(name, {})
+        elif self.initial:
+            defaults['initial'] = self._subform_initials.get(name, {})
         defaults.update(kwargs)
         return super(MergingFormMixin, self)._construct_form(name, **defaults)
 
+    @cached_property
+    def _subform_initials(self):
+        """ Dict of form name: initial, from own initial partitioned once """
+        return self._partition_initial(self.initial)
+
+    def _partition_initial(self, initial):
+        """ Split initial values into a dict of form name: initial, in a single pass
+
+            Values are either given under aliases, as in {'form.field': value},
+            or as one dict per form, as in {'form': {'field': value}}. Linked
+            fields have no alias, so they are only passed in per form dicts,
+            where linked fields are pulled from.
+        """
+        result = {}
+        for key, value in initial.items():
+            form_name, dot, field_name = key.partition('.')
+            if not dot:
+                if isinstance(value, Mapping) and key in self.form_classes:
+                    result.setdefault(key, {}).update(value)
+            elif field_name not in self.linked_fields and '.' not in field_name:
+                result.setdefault(form_name, {})[field_name] = value
+        return result
+
     def __getitem__(self, name):
         """ Retrieve the field by name, merging own field with content form's """
         if name in self.field_form:
@@ -153,24 +758,55 @@ class MergingFormMixin(BaseForm):
             return form.__getitem__(field_name)
         return super(MergingFormMixin, self).__getitem__(name)
 
+    def reset_own_fields(self):
+        """ Forget own fields, to be called when fields change after cleaning """
+        self._own_fields = None
+
     def _clean_fields(self):
         """ Omit merged fields from _clean_fields, as they would be seen as all empty """
+        if self._own_fields is None:
+            self._own_fields = OrderedDict((name, field) for name, field in self.fields.items()
+                                           if name not in self.field_form)
         fields = self.fields
-        self.fields = dict((k, v) for k, v in fields.items() if not k in self.field_form)
-        super(MergingFormMixin, self)._clean_fields()
-        self.fields = fields
+        self.fields = self._own_fields
+        try:
+            super(MergingFormMixin, self)._clean_fields()
+        finally:
+            self.fields = fields
 
     def _clean_form(self):
         """ Merge in subform errors and cleaned_data under their alias names """
         super(MergingFormMixin, self)._clean_form()
-        for form_name, form in self.forms.items():
-            for field_name, errors in form.errors.items():
-                if field_name != NON_FIELD_ERRORS:
-                    field_name = self._get_alias(form_name, field_name)
-                self._errors.setdefault(field_name, set()).update(errors)
-            self.cleaned_data.update((self._get_alias(form_name, name), data)
-                                     for name, data in form.cleaned_data.items()
-                                     if name not in self.linked_fields)
+        pending = [(form_name, form) for form_name, form in self.forms.items()
+                   if form.is_bound and form._errors is None]
+        executor = self.validation_executor
+        if executor is not None and len(pending) > 1:
+            futures = [executor.submit(timed, self, 'full_clean', form_name, form.full_clean)
+                       for form_name, form in pending]
+            for future in futures:  # wait for all, raising exceptions in order
+                future.result()
+        else:
+            for form_name, form in pending:
+                timed(self, 'full_clean', form_name, form.full_clean)
+        self._merge_subforms()
+
+    def _merge_subforms(self):
+        self._errors = MergedErrorDict(self._errors, self)
+        self.cleaned_data = MergedCleanedData(self.cleaned_data, self)
+
+    @property
+    def errors(self):
+        """ Merged errors, all stored in the dict for code reading it directly """
+        errors = super(MergingFormMixin, self).errors
+        if isinstance(errors, MergedErrorDict):
+            errors.materialize()
+        return errors
+
+    def is_valid(self):
+        """ Only check whether there are errors, without merging them """
+        if self._errors is None:
+            self.full_clean()
+        return self.is_bound and not self._errors
 
     @property
     def changed_data(self):
@@ -178,7 +814,8 @@ class MergingFormMixin(BaseForm):
         if self._changed_data is None:
             ret = set(super(MergingFormMixin, self).changed_data)
             for form_name, form in self.forms.items():
-                ret.update(self._get_alias(form_name, name) for name in form.changed_data)
+                if form.is_bound or not self.is_bound:
+                    ret.update(self._get_alias(form_name, name) for name in form.changed_data)
             self._changed_data = tuple(ret)
         return self._changed_data
 
@@ -194,8 +831,12 @@ class BaseProxyForm(SubFormsProxyMixin):
     """ Compound form that proxies fields to its subforms """
     def __init__(self, *args, **kwargs):
         self.forms = kwargs.pop('forms')
-        self.linked_fields = self.linked_fields.copy()
-        self.linked_fields.update(kwargs.pop('linked_fields', {}))
+        linked_fields = kwargs.pop('linked_fields', None)
+        if not self.linked_fields and linked_fields is not None:
+            self.linked_fields = linked_fields  # not modified, can be shared
+        else:
+            self.linked_fields = self.linked_fields.copy()
+            self.linked_fields.update(linked_fields or {})
         super(BaseProxyForm, self).__init__(*args, **kwargs)
 
 class BaseMergingProxyForm(MergingFormMixin, BaseProxyForm):
@@ -227,10 +868,40 @@ class MergingCompoundForm(Form, BaseMergingCompoundForm):
 class MergingCompoundModelForm(Form, ModelSubFormsMixin, BaseMergingCompoundForm):
     pass
 
-def compoundform_factory(forms, base=MergingCompoundForm, linked_fields=None):
-    attrs = {
-        'form_classes': forms,
-    }
-    if linked_fields is not None:
-        attrs['linked_fields'] = linked_fields
-    return type(base.__name__, (base,), attrs)
+##############################################################################
+
+FACTORY_CACHE_SIZE = 256
+factory_cache = LRUCache(FACTORY_CACHE_SIZE)
+
+MEDIA_CACHE_SIZE = 256
+media_cache = LRUCache(MEDIA_CACHE_SIZE)
+
+def clear_factory_cache():
+    """ Drop all classes memoized by compoundform_factory and compoundformset_factory """
+    factory_cache.clear()
+
+def _cached_class(key, build):
+    """ Return the class cached under key, building it if needed """
+    try:
+        klass = factory_cache.get(key)
+    except TypeError:   # unhashable arguments, cannot memoize them
+        return build()
+    if klass is None:
+        klass = build()
+        factory_cache.set(key, klass)
+    return klass
+
+def compoundform_factory(forms, base=MergingCompoundForm, linked_fields=None, cache=False):
+    """ Build a compound form class. If cache is set, equal arguments give the same class """
+    def build():
+        attrs = {
+            'form_classes': forms,
+        }
+        if linked_fields is not None:
+            attrs['linked_fields'] = linked_fields
+        return type(base.__name__, (base,), attrs)
+    if not cache:
+        return build()
+    return _cached_class((compoundform_factory, base, tuple(forms.items()),
+                          None if linked_fields is None else tuple(linked_fields.items())),
+                         build)
@@ -1,10 +1,25 @@
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
 from django.forms.formsets import (BaseFormSet,
                                    ORDERING_FIELD_NAME, DELETION_FIELD_NAME)
 from django.utils.functional import cached_property
+try:
+    from django.core.exceptions import FieldDoesNotExist
+except ImportError:     # django < 1.8
+    from django.db.models.fields import FieldDoesNotExist
 from collections import OrderedDict
+import itertools
+import sys
 
-from .forms import MergingProxyForm
+from .forms import MergingProxyForm, _cached_class, save_instances
+from .signals import timed
+
+if sys.version_info >= (3, 5):
+    from .aio import AsyncSubFormSetsMixin
+else:
+    class AsyncSubFormSetsMixin(object):
+        """ Coroutine API requires python 3.5 """
 
 ##############################################################################
 
@@ -14,11 +29,34 @@ class InvalidFormsetsError(ValueError):
 ##############################################################################
 
 class SubFormSetsBuildMixin(BaseFormSet):
+    """ Base formset building its sub-formsets
+
+        Passing offset, limit or after (a group key, as a tuple of values of
+        formset_group_fields) restricts it to a window of initial row groups,
+        ordered by group key. Model sub-formsets only query that window, which
+        requires group fields to be model fields. The same window must be
+        given when binding submitted data.
+    """
     formset_classes = OrderedDict()
 
+    def __init__(self, *args, **kwargs):
+        self.offset = kwargs.pop('offset', 0)
+        self.limit = kwargs.pop('limit', None)
+        self.after = kwargs.pop('after', None)
+        if self.after is not None and not isinstance(self.after, tuple):
+            self.after = (self.after,)
+        super(SubFormSetsBuildMixin, self).__init__(*args, **kwargs)
+        if self.is_windowed and self.initial:
+            self.initial = self._window_initial(self.initial)
+
+    @property
+    def is_windowed(self):
+        return bool(self.offset) or self.limit is not None or self.after is not None
+
     @cached_property
     def formsets(self):
-        return OrderedDict((name, self._construct_formset(name))
+        return OrderedDict((name, timed(self, 'construct_formset', name,
+                                        self._construct_formset, name))
                            for name in self.formset_classes.keys())
 
     def _construct_formset(self, name, **kwargs):
@@ -34,11 +72,64 @@ class SubFormSetsBuildMixin(BaseFormSet):
         if self.initial:
             defaults['initial'] = self.initial
         defaults.update(kwargs)
-        return klass(**defaults)
+        formset = klass(**defaults)
+        if self.is_windowed and hasattr(formset, 'get_queryset'):
+            formset._queryset = self._window_queryset(formset)
+        return formset
+
+    def _window_initial(self, initial):
+        """ Window of initial data, for formsets without a queryset
+
+            Rows are ordered by group key, missing values defaulting to the
+            initial value of the first sub-formset's form fields. None sorts
+            first, as NULL does in the ascending order of _window_queryset on
+            sqlite and mysql.
+        """
+        fields = tuple(self.formset_group_fields.keys())
+        base_fields = next(iter(self.formset_classes.values())).form.base_fields
+        defaults = tuple(base_fields[field].initial if field in base_fields else None
+                         for field in fields)
+        def sort_key(values):
+            return tuple((value is not None, value) for value in values)
+        keyed = sorted(((sort_key(row.get(field, default)
+                                  for field, default in zip(fields, defaults)), row)
+                        for row in initial), key=lambda item: item[0])
+        if self.after is not None:
+            after = sort_key(self.after)
+            keyed = [item for item in keyed if item[0] > after]
+        end = None if self.limit is None else self.offset + self.limit
+        return [row for key, row in keyed[self.offset:end]]
+
+    def _window_queryset(self, formset):
+        """ Window of a model formset's queryset """
+        fields = tuple(self.formset_group_fields.keys())
+        queryset = formset.get_queryset().order_by(*(fields + ('pk',)))
+        if formset.is_bound:
+            # match submitted objects, even if the window moved since rendering
+            try:
+                count = formset.initial_form_count()
+            except ValidationError:     # reported by management_form
+                return queryset.none()
+            pk_name = formset.model._meta.pk.name
+            pks = [formset.data.get('%s-%s' % (formset.add_prefix(i), pk_name))
+                   for i in range(count)]
+            return queryset.filter(pk__in=[pk for pk in pks if pk])
+        if self.after is not None:
+            queryset = queryset.filter(self._after_filter(fields, self.after))
+        end = None if self.limit is None else self.offset + self.limit
+        return queryset[self.offset:end]
+
+    @staticmethod
+    def _after_filter(fields, key):
+        """ Q object selecting rows whose group fields sort after key """
+        query = Q(**{fields[-1] + '__gt': key[-1]})
+        for field, value in reversed(tuple(zip(fields, key))[:-1]):
+            query = Q(**{field + '__gt': value}) | (Q(**{field: value}) & query)
+        return query
 
 ##############################################################################
 
-class InlineSubFormSetsMixin(SubFormSetsBuildMixin):
+class InlineSubFormSetsMixin(AsyncSubFormSetsMixin, SubFormSetsBuildMixin):
     def __init__(self, *args, **kwargs):
         self.instances = kwargs.pop('instances', {})
         super(InlineSubFormSetsMixin, self).__init__(*args, **kwargs)
@@ -53,12 +144,33 @@ class InlineSubFormSetsMixin(SubFormSetsBuildMixin):
         defaults.update(kwargs)
         return super(InlineSubFormSetsMixin, self)._construct_formset(name, **defaults)
 
-    def save(self, only=None, **kwargs):
+    def save(self, only=None, bulk=False, **kwargs):
+        """ Save sub-formsets
+
+            With bulk set, all sub-formsets are saved in a single transaction:
+            deletions are issued per model, then other rows are saved through
+            save_instances(), grouping queries per model.
+        """
         keys = self.formsets.keys() if only is None else only
-        return OrderedDict((name, self._save_formset(name, **kwargs)) for name in keys)
+        if not bulk or not kwargs.get('commit', True):
+            return OrderedDict((name, self._save_formset(name, **kwargs)) for name in keys)
+
+        kwargs['commit'] = False
+        with transaction.atomic():
+            result = OrderedDict((name, self._save_formset(name, **kwargs)) for name in keys)
+            deleted = OrderedDict()
+            for name in keys:
+                for instance in self.formsets[name].deleted_objects:
+                    deleted.setdefault(type(instance), []).append(instance.pk)
+            for model, pks in deleted.items():
+                model._default_manager.filter(pk__in=pks).delete()
+            save_instances(instance for instances in result.values() for instance in instances)
+            for name in keys:
+                self.formsets[name].save_m2m()
+        return result
 
     def _save_formset(self, name, **kwargs):
-        return self.formsets[name].save(**kwargs)
+        return timed(self, 'save', name, self.formsets[name].save, **kwargs)
 
 ##############################################################################
 
@@ -66,18 +178,29 @@ class SubFormSetsProxyMixin(BaseFormSet):
     form = MergingProxyForm
     formset_group_fields = OrderedDict()
     validate_max = False
+    # Do not clean sub-forms of initial rows whose data did not change
+    skip_unchanged_rows = False
 
     @property
     def management_form(self):
-        forms = dict((name, formset.management_form) for name, formset in self.formsets.items())
-        kwargs = {
-            'forms': forms,
-        }
-        if self.is_bound:
-            kwargs['data'] = self.data
-            kwargs['files'] = self.files
-        form = MergingProxyForm(**kwargs)
-        if self.is_bound and not form.is_valid():
+        """ Compound management form, built once unless the formset is rebound """
+        binding = (self.data, self.files, self.formsets)
+        cached = getattr(self, '_management_form', None)
+        if cached is not None and all(a is b for a, b in zip(cached[0], binding)):
+            form = cached[1]
+        else:
+            if cached is not None:      # rebound, counts may differ
+                self.reset_counts()
+            forms = dict((name, formset.management_form) for name, formset in self.formsets.items())
+            kwargs = {
+                'forms': forms,
+            }
+            if self.is_bound:
+                kwargs['data'] = self.data
+                kwargs['files'] = self.files
+            form = MergingProxyForm(**kwargs)
+            self._management_form = (binding, form)
+        if self.is_bound and not form.is_valid():    # validation result is cached
             raise ValidationError('Invalid management form')
         return form
 
@@ -89,61 +212,193 @@ class SubFormSetsProxyMixin(BaseFormSet):
     def forms(self):
         #TODO: peek at initial data to guess the number beforehand and alter
         # subformset's management form TOTAL/extra
-        groups, extras = OrderedDict(), []
-        # Fill groups with forms from formsets
+        indexes = self._initial_group_indexes()
+        if indexes is None:
+            groups = self._group_initial_forms()
+        else:   # groups are known, only build forms now
+            groups = [OrderedDict((name, self.formsets[name].forms[index])
+                                  for name, index in row.items())
+                      for row in indexes.values()]
+        extras = self._group_extra_forms()
+
+        return tuple(self._construct_rows(itertools.chain(groups, extras)))
+
+    def _construct_rows(self, groups):
+        """ Construct row forms from groups of sub-forms, sharing linked fields and layout """
+        linked_fields = self._row_linked_fields()
+        layout = None
+        for i, group in enumerate(groups):
+            kwargs = {'forms': group, 'linked_fields': linked_fields}
+            if layout is not None:
+                kwargs['field_layout'] = layout
+            form = self._construct_form(i, **kwargs)
+            if layout is None:
+                layout = getattr(form, 'field_layout', None)
+            yield form
+
+    def _row_linked_fields(self):
+        """ Linked fields of row forms: group fields, and ordering and deletion flags """
+        linked_fields = self.formset_group_fields.copy()
+        if self.can_order:
+            linked_fields[ORDERING_FIELD_NAME] = None
+        if self.can_delete:
+            linked_fields[DELETION_FIELD_NAME] = None
+        return linked_fields
+
+    def iter_forms(self):
+        """ Iterate over row forms, building them one at a time without keeping them
+
+            Rows are only built that way when groups can be known beforehand,
+            see _initial_group_indexes(). Otherwise, this iterates over forms.
+        """
+        indexes = None if 'forms' in self.__dict__ else self._initial_group_indexes()
+        if indexes is None:
+            for form in self.forms:
+                yield form
+            return
+
+        initial = (OrderedDict((name, self.formsets[name]._construct_form(index))
+                               for name, index in row.items())
+                   for row in indexes.values())
+        extras = (OrderedDict((name, formset._construct_form(i))
+                              for name, formset in self.formsets.items())
+                  for i in range(len(indexes), self.total_form_count()))
+        for form in self._construct_rows(itertools.chain(initial, extras)):
+            yield form
+
+    def render_stream(self, method='as_table'):
+        """ Iterate over the rendered formset, one row at a time, for StreamingHttpResponse
+
+            Joined output is the same as the method's, as_table, as_p or as_ul.
+        """
+        yield '%s\n' % self.management_form
+        for i, form in enumerate(self.iter_forms()):
+            yield (' ' if i else '') + getattr(form, method)()
+
+    def _group_key(self, form):
+        """ Grouping key of a sub-form, from fields in formset_group_fields """
+        return tuple(form.initial.get(field, form.fields[field].initial)
+                     for field in self.formset_group_fields.keys())
+
+    def _group_initial_forms(self):
+        """ Group initial forms of sub-formsets by key, building them all """
+        groups = OrderedDict()
         first = True
         for formset_name, formset in self.formsets.items():
-            # Group initial forms by key (generated from fields in formset_group_fields)
             for form in formset.initial_forms:
-                key = tuple(form.initial.get(field, form.fields[field].initial)
-                            for field in self.formset_group_fields.keys())
+                key = self._group_key(form)
                 if first:
-                    groups[key] = {formset_name: form}
+                    groups[key] = OrderedDict(((formset_name, form),))
                 else:   # ensure a mismatch key raises an exception
                     groups[key][formset_name] = form
 
             # Check that formset grouping is correct
-            if not first:
-                if formset.initial_form_count() != len(groups):
-                    raise InvalidFormsetsError(
-                        'formsets do not have the same number of initial form groups: %d != %d' %
-                        (formset.initial_form_count(), len(groups))
-                    )
-                if len(formset.extra_forms) != len(extras):
-                    raise InvalidFormsetsError(
-                        'formsets do not have the same number of extra forms: %d != %d' %
-                        (len(formset.extra_forms), len(extras))
-                    )
-
-            # Simply group extra forms by their index
-            for index, form in enumerate(formset.extra_forms):
-                if first:
-                    extras.append({formset_name: form})
-                else:
-                    extras[index][formset_name] = form
-
+            if not first and formset.initial_form_count() != len(groups):
+                raise InvalidFormsetsError(
+                    'formsets do not have the same number of initial form groups: %d != %d' %
+                    (formset.initial_form_count(), len(groups))
+                )
             first = False
+        return list(groups.values())
 
-        linked_fields = self.formset_group_fields.copy()
-        if self.can_order:
-            linked_fields[ORDERING_FIELD_NAME] = None
-        if self.can_delete:
-            linked_fields[DELETION_FIELD_NAME] = None
+    def _group_extra_forms(self):
+        """ Group extra forms of sub-formsets by their index """
+        extras = None
+        for formset_name, formset in self.formsets.items():
+            if extras is None:
+                extras = [OrderedDict() for form in formset.extra_forms]
+            elif len(formset.extra_forms) != len(extras):
+                raise InvalidFormsetsError(
+                    'formsets do not have the same number of extra forms: %d != %d' %
+                    (len(formset.extra_forms), len(extras))
+                )
+            for index, form in enumerate(formset.extra_forms):
+                extras[index][formset_name] = form
+        return extras or []
+
+    def _initial_group_keys(self, formset):
+        """ Grouping keys of a sub-formset's initial forms, computed without building them
+
+            Returns None if they cannot be known beforehand: bound formsets
+            match initial forms using submitted data, and model formsets can
+            only be peeked at if grouping fields are model fields.
+        """
+        if formset.is_bound:
+            return None
+        fields = tuple(self.formset_group_fields.keys())
+        if hasattr(formset, 'get_queryset'):
+            if formset.initial:     # overrides model values
+                return None
+            opts = formset.model._meta
+            try:
+                model_fields = [opts.get_field(field) for field in fields]
+            except FieldDoesNotExist:
+                return None
+            if any(field in opts.many_to_many for field in model_fields):
+                return None
+            # evaluates the queryset formset forms will be built from, as model_to_dict()
+            return [tuple(field.value_from_object(obj) for field in model_fields)
+                    for obj in formset.get_queryset()]
+        base_fields = formset.form.base_fields
+        if any(field not in base_fields for field in fields):
+            return None             # added at runtime, form must be built
+        return [tuple(initial.get(field, base_fields[field].initial) for field in fields)
+                for initial in (formset.initial or ())[:formset.initial_form_count()]]
+
+    def _initial_group_indexes(self):
+        """ Dict of key: {formset name: index} locating the sub-forms of each initial row
+
+            Mismatches amongst sub-formsets raise InvalidFormsetsError before any
+            form is built. Returns None if keys cannot be known beforehand.
+        """
+        groups = None
+        for formset_name, formset in self.formsets.items():
+            keys = self._initial_group_keys(formset)
+            if keys is None:
+                return None
+            positions = OrderedDict((key, index) for index, key in enumerate(keys))
+            if len(positions) != len(keys):
+                raise InvalidFormsetsError('formset %s has duplicate form group keys' %
+                                           formset_name)
+            if groups is None:
+                groups = OrderedDict((key, OrderedDict(((formset_name, index),)))
+                                     for key, index in positions.items())
+                continue
+            unmatched = ([key for key in groups if key not in positions] +
+                         [key for key in positions if key not in groups])
+            if unmatched:
+                raise InvalidFormsetsError('formset %s has unmatched form group keys: %r' %
+                                           (formset_name, unmatched))
+            for key, group in groups.items():
+                group[formset_name] = positions[key]
+        return groups
+
+    def _memoized(self, name, compute):
+        """ Compute value once per instance. Failures are not memoized """
+        counts = self.__dict__.setdefault('_counts', {})
+        try:
+            return counts[name]
+        except KeyError:
+            value = counts[name] = compute()
+            return value
 
-        forms = (tuple(self._construct_form(i, forms=group, linked_fields=linked_fields)
-                       for i, group in enumerate(groups.values()))
-                 +
-                 tuple(self._construct_form(i, forms=group, linked_fields=linked_fields)
-                       for i, group in enumerate(extras, len(groups))))
-        return forms
+    def reset_counts(self):
+        """ Forget memoized form counts and flags, if sub-formsets changed """
+        self.__dict__.pop('_counts', None)
 
     def initial_form_count(self):
+        return self._memoized('initial_form_count', self._initial_form_count)
+
+    def _initial_form_count(self):
         count = next(iter(self.formsets.values())).initial_form_count()
         if any(formset.initial_form_count() != count for formset in self.formsets.values()):
             raise InvalidFormsetsError('initial_form_count()s differ amongst sub-formsets')
         return count
 
     def total_form_count(self):
+        return self._memoized('total_form_count', self._total_form_count)
+
+    def _total_form_count(self):
         count = next(iter(self.formsets.values())).total_form_count()
         if any(formset.total_form_count() != count for formset in self.formsets.values()):
             raise InvalidFormsetsError('total_form_count()s differ amongst sub-formsets')
@@ -155,8 +410,7 @@ class SubFormSetsProxyMixin(BaseFormSet):
         if not self.is_bound:
             return
 
-        for i in range(0, self.total_form_count()):
-            self.forms[i].push_linked_fields()
+        self._prepare_clean()
 
         unique_non_form_errors = set()
         for formset in self.formsets.values():
@@ -171,18 +425,38 @@ class SubFormSetsProxyMixin(BaseFormSet):
         except ValidationError as e:
             self._non_form_errors = self.error_class(e.messages)
 
+    def _prepare_clean(self):
+        """ Push linked values of rows and skip unchanged rows, before cleaning """
+        for i in range(0, self.total_form_count()):
+            timed(self, 'push_linked_fields', None, self.forms[i].push_linked_fields)
+        if self.skip_unchanged_rows:
+            for form in self.forms[:self.initial_form_count()]:
+                if form.skipped_forms:
+                    continue
+                # linked values were pushed, subforms see the whole row's changes
+                if not any(subform.has_changed() for subform in form.forms.values()):
+                    for name, subform in form.forms.items():
+                        form.skip_form(name, subform)
+
     @property
     def min_num(self):
         """ Django >= 1.7 """
-        return max(formset.min_num for formset in self.formsets.values())
+        return self._memoized('min_num', lambda: max(formset.min_num
+                                                     for formset in self.formsets.values()))
 
     @property
     def can_order(self):
-        return all(formset.can_order for formset in self.formsets.values())
+        return self._memoized('can_order', lambda: all(formset.can_order
+                                                       for formset in self.formsets.values()))
 
     @property
     def can_delete(self):
-        return all(formset.can_delete for formset in self.formsets.values())
+        return self._memoized('can_delete', lambda: all(formset.can_delete
+                                                        for formset in self.formsets.values()))
+
+    def add_fields(self, form, index):
+        super(SubFormSetsProxyMixin, self).add_fields(form, index)
+        form.reset_own_fields()     # ordering and deletion fields were added
 
     @property
     def empty_form(self):
@@ -206,10 +480,19 @@ class CompoundFormSet(SubFormSetsBuildMixin, SubFormSetsProxyMixin, BaseFormSet)
 class CompoundInlineFormSet(InlineSubFormSetsMixin, SubFormSetsProxyMixin, BaseFormSet):
     pass
 
-def compoundformset_factory(formsets, base=CompoundFormSet, formset_group_fields=None):
-    attrs = {
-        'formset_classes': formsets,
-    }
-    if formset_group_fields is not None:
-        attrs['formset_group_fields'] = formset_group_fields
-    return type(base.__name__, (base,), attrs)
+def compoundformset_factory(formsets, base=CompoundFormSet, formset_group_fields=None,
+                            cache=False):
+    """ Build a compound formset class. If cache is set, equal arguments give the same class """
+    def build():
+        attrs = {
+            'formset_classes': formsets,
+        }
+        if formset_group_fields is not None:
+            attrs['formset_group_fields'] = formset_group_fields
+        return type(base.__name__, (base,), attrs)
+    if not cache:
+        return build()
+    return _cached_class((compoundformset_factory, base, tuple(formsets.items()),
+                          None if formset_group_fields is None
+                          else tuple(formset_group_fields.items())),
+                         build)
@@ -0,0 +1,22 @@
+from django.dispatch import Signal
+from timeit import default_timer
+
+# Sent after each timed lifecycle phase of a compound form or formset:
+#   phase: 'construct_form', 'construct_formset', 'pull_linked_fields',
+#          'push_linked_fields', 'full_clean', 'merge_errors' or 'save'
+#          ('merge_errors' times storing merged errors once they are read
+#          as a whole, as by MergingFormMixin.errors)
+#   name: the subform or sub-formset the phase applies to, or None
+#   duration: wall time of the phase, in seconds
+phase_timed = Signal()
+
+def timed(instance, phase, name, function, *args, **kwargs):
+    """ Call function, timing it if phase_timed has receivers """
+    if not phase_timed.receivers:   # keep overhead minimal when nobody listens
+        return function(*args, **kwargs)
+    start = default_timer()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        phase_timed.send(sender=type(instance), instance=instance, phase=phase,
+                         name=name, duration=default_timer() - start)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+""" Benchmark compound forms and formsets.
+
+    Results are written as JSON, and can be compared with those of another run:
+        python runbenchmarks.py --output before.json
+        python runbenchmarks.py --compare before.json
+"""
+
+import argparse, json, os, sys
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'test_project.settings'
+root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'test_project'))
+
+import django
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark compound forms and formsets.')
+    parser.add_argument('--subforms', type=int_list, default=[2, 8],
+                        help='comma-separated numbers of subforms (default: 2,8)')
+    parser.add_argument('--fields', type=int_list, default=[4, 16],
+                        help='comma-separated numbers of fields per subform (default: 4,16)')
+    parser.add_argument('--linked', type=int_list, default=[0, 2],
+                        help='comma-separated numbers of linked fields (default: 0,2)')
+    parser.add_argument('--rows', type=int_list, default=[10, 100],
+                        help='comma-separated numbers of formset rows (default: 10,100)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per benchmark (default: 5)')
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', help='compare results with this JSON file')
+    return parser.parse_args()
+
+def case_key(result):
+    return '%s(%s)' % (result['name'],
+                       ', '.join('%s=%s' % item for item in sorted(result['params'].items())))
+
+def compare(results, path):
+    with open(path) as fd:
+        previous = dict((case_key(result), result) for result in json.load(fd)['results'])
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        sys.stdout.write('%-60s time %+7.1f%%  queries %+d\n' % (
+            case_key(result),
+            100.0 * (result['time_min'] / old['time_min'] - 1),
+            result['queries'] - old['queries'],
+        ))
+
+def runbenchmarks():
+    args = parse_args()
+    try:
+        django.setup()
+    except AttributeError:
+        pass
+    from django.db import connection
+    from benchmarks.cases import cases
+    from benchmarks.measure import run_case
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    results = []
+    try:
+        for name, params, function in cases(args.subforms, args.fields,
+                                            args.linked, args.rows):
+            if args.filter not in name:
+                continue
+            result = {'name': name, 'params': params}
+            result.update(run_case(function, params, args.repeat))
+            results.append(result)
+            sys.stderr.write('%-60s %9.3fms %5d queries\n' % (
+                case_key(result), 1000 * result['time_min'], result['queries']))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report = {
+        'python': sys.version.split()[0],
+        'django': django.get_version(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    runbenchmarks()
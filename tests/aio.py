@@ -0,0 +1,268 @@
+from django.db import connections
+from django.forms import CharField
+from collections import OrderedDict
+import sys
+import threading
+import unittest
+from compound_forms.forms import MergingCompoundModelForm, compoundform_factory
+from compound_forms.formsets import CompoundInlineFormSet, compoundformset_factory
+
+from app.models import Normal, Other
+from app.forms import NormalForm, OtherForm, NormalRelatedFormset, OtherRelatedFormset
+from .data import NORMALREL
+from .fixtures import (NormalFixture, NormalRelatedFixture,
+                       OtherFixture, OtherRelatedFixture)
+from .formdata import FormData
+from .utils import TestCase
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from unittest import mock
+    from compound_forms import aio
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'coroutine API requires python 3.5')
+class AsyncTestMixin(object):
+    """ Run coroutines on a private loop, recording threads blocking calls run in
+
+        Thread-sensitive calls run in a thread of the test, as asgiref's, and
+        concurrent ones in a pool given as validation_executor. As
+        LiveServerTestCase does, those threads share the test thread's
+        connections: test data lives in the test transaction.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.threads = []
+        self.shared = dict((conn.alias, conn) for conn in connections.all())
+        for conn in self.shared.values():
+            conn.allow_thread_sharing = True
+        self.sensitive = ThreadPoolExecutor(max_workers=1)
+        self.workers = ThreadPoolExecutor(max_workers=4)
+        patcher = mock.patch('compound_forms.aio.to_thread', self.to_thread)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super(AsyncTestMixin, self).setUp()
+
+    def tearDown(self):
+        super(AsyncTestMixin, self).tearDown()
+        self.sensitive.shutdown()
+        self.workers.shutdown()
+        for conn in connections.all():
+            conn.allow_thread_sharing = False
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _call(self, function, *args, **kwargs):
+        self.threads.append(threading.current_thread())
+        for alias, conn in self.shared.items():
+            connections[alias] = conn
+        return function(*args, **kwargs)
+
+    def to_thread(self, function, *args, **kwargs):
+        return asyncio.wrap_future(self.sensitive.submit(self._call, function,
+                                                         *args, **kwargs))
+
+    def submit(self, function, *args, **kwargs):
+        """ validation_executor interface """
+        return self.workers.submit(self._call, function, *args, **kwargs)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def assertOffLoop(self, count):
+        """ Blocking calls all ran in a worker thread """
+        self.assertEqual(len(self.threads), count)
+        self.assertNotIn(threading.current_thread(), self.threads)
+
+    def test_async_worker(self):
+        """ Without executor, concurrent calls run in worker threads """
+        thread = self.run_async(aio.to_worker(None, threading.current_thread))
+        self.assertIsNot(thread, threading.current_thread())
+
+
+class AsyncCompoundFormTest(AsyncTestMixin, NormalFixture, OtherFixture, TestCase):
+    normal_count = 1
+    other_count = 1
+
+    def _get_form(self, **kwargs):
+        form = compoundform_factory(
+            OrderedDict((('normal', NormalForm), ('other', OtherForm))),
+            linked_fields=OrderedDict((('common', CharField(max_length=255, required=False)),)),
+            base=MergingCompoundModelForm,
+        )
+        return form(validation_executor=self, **kwargs)
+
+    def test_async_validate_save(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        form = self._get_form(instances={'normal': normal, 'other': other})
+        data = FormData(form)
+        data.set_form_field(form, 'common', 'updated_common')
+        data.set_form_field(form, 'other.field_a', 'updated_ofa')
+
+        form = self._get_form(instances={'normal': normal, 'other': other}, data=data)
+        self.assertTrue(self.run_async(form.ais_valid()))
+        self.assertOffLoop(4)   # linked fields, each subform, then form itself
+        self.assertEqual(form.cleaned_data['other.field_a'], 'updated_ofa')
+
+        result = self.run_async(form.asave())
+        self.assertEqual(tuple(result.keys()), ('normal', 'other'))
+        self.assertIs(result['normal'], normal)
+        self.assertEqual(Normal.objects.get(pk=self.normal_id[1]).common, 'updated_common')
+        self.assertEqual(Other.objects.get(pk=self.other_id[1]).field_a, 'updated_ofa')
+
+    def test_async_skip_unchanged(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        form = self._get_form(instances={'normal': normal, 'other': other})
+        data = FormData(form)
+        data.set_form_field(form, 'other.field_a', 'updated_ofa')
+
+        form = self._get_form(instances={'normal': normal, 'other': other}, data=data)
+        form.skip_unchanged_forms = ('normal', 'other')
+        self.assertTrue(self.run_async(form.ais_valid()))
+        self.assertEqual(form.skipped_forms, set(['normal']))
+        self.assertOffLoop(3)   # linked fields, other subform, then form itself
+
+        Normal.objects.filter(pk=self.normal_id[1]).update(field_a='concurrent')
+        self.run_async(form.asave())
+        self.assertEqual(Normal.objects.get(pk=self.normal_id[1]).field_a, 'concurrent')
+        self.assertEqual(Other.objects.get(pk=self.other_id[1]).field_a, 'updated_ofa')
+
+    def test_async_concurrent(self):
+        """ Subforms are cleaned at the same time """
+        barrier = threading.Barrier(2, timeout=5)
+        class WaitingNormalForm(NormalForm):
+            def clean(self):
+                barrier.wait()
+                return super(WaitingNormalForm, self).clean()
+        class WaitingOtherForm(OtherForm):
+            def clean(self):
+                barrier.wait()
+                return super(WaitingOtherForm, self).clean()
+        klass = compoundform_factory(
+            OrderedDict((('normal', WaitingNormalForm), ('other', WaitingOtherForm))),
+            linked_fields=OrderedDict((('common', CharField(max_length=255, required=False)),)),
+            base=MergingCompoundModelForm,
+        )
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        data = FormData(klass(instances={'normal': normal, 'other': other}))
+        form = klass(instances={'normal': normal, 'other': other}, data=data,
+                     validation_executor=self)
+        self.assertTrue(self.run_async(form.ais_valid()))
+        self.assertFalse(barrier.broken)
+
+    def test_async_validate_errors(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        form = self._get_form(instances={'normal': normal, 'other': other})
+        data = FormData(form)
+        data.set_form_field(form, 'common', '')
+
+        form = self._get_form(instances={'normal': normal, 'other': other}, data=data)
+        self.assertFalse(self.run_async(form.ais_valid()))
+        self.assertCountEqual(form.errors, ('common',))
+
+
+class AsyncCompoundInlineFormSetTest(AsyncTestMixin, NormalRelatedFixture, NormalFixture,
+                                     OtherRelatedFixture, OtherFixture, TestCase):
+    normal_count = other_count = 2
+    normalrel_count = otherrel_count = 4
+
+    def _get_formset(self, **kwargs):
+        formset = compoundformset_factory(
+            OrderedDict((
+                ('normalrel', NormalRelatedFormset),
+                ('otherrel', OtherRelatedFormset),
+            )),
+            base=CompoundInlineFormSet,
+            formset_group_fields=OrderedDict((
+                ('common', CharField(max_length=255, required=False)),
+            )),
+        )
+        formset = formset(**kwargs)
+        formset.validation_executor = self
+        return formset
+
+    def test_async_validate_save(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[2])
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other})
+        data = FormData(formset)
+        data.set_formset_field(formset, 0, 'common', 'updated_common_1')
+        data.set_formset_field(formset, 1, 'otherrel.field_a', 'updated_fa_2')
+
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other},
+                                    data=data)
+        self.assertTrue(self.run_async(formset.ais_valid()))
+        self.assertOffLoop(4)   # rows, each sub-formset, then formset itself
+
+        result = self.run_async(formset.asave())
+        self.assertEqual(tuple(result.keys()), ('normalrel', 'otherrel'))
+        nrelqs = normal.related_set.order_by('id')
+        orelqs = other.related_set.order_by('id')
+        self.assertEqual(nrelqs[0].common, 'updated_common_1')
+        self.assertEqual(orelqs[0].common, 'updated_common_1')
+        self.assertEqual(nrelqs[1].field_a, NORMALREL[3].field_a)
+        self.assertEqual(orelqs[1].field_a, 'updated_fa_2')
+
+    def test_async_save_atomic(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[2])
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other})
+        data = FormData(formset)
+        data.set_formset_field(formset, 0, 'normalrel.field_a', 'updated_fa_1')
+
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other},
+                                    data=data)
+        self.assertTrue(self.run_async(formset.ais_valid()))
+        formset.formsets['otherrel'].save = mock.Mock(side_effect=RuntimeError)
+        self.assertRaises(RuntimeError, self.run_async, formset.asave())
+        self.assertEqual(normal.related_set.order_by('id')[0].field_a, NORMALREL[1].field_a)
+
+    def test_async_skip_unchanged_rows(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[2])
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other})
+        data = FormData(formset)
+        data.set_formset_field(formset, 1, 'otherrel.field_a', 'updated_fa_2')
+
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other},
+                                    data=data)
+        formset.skip_unchanged_rows = True
+        self.assertTrue(self.run_async(formset.ais_valid()))
+        self.assertEqual(formset.forms[0].skipped_forms, set(['normalrel', 'otherrel']))
+        self.assertEqual(formset.forms[1].skipped_forms, set())
+
+    def test_async_concurrent(self):
+        """ Sub-formsets are cleaned at the same time """
+        barrier = threading.Barrier(2, timeout=5)
+        class WaitingNormalRelatedFormset(NormalRelatedFormset):
+            def clean(self):
+                barrier.wait()
+                return super(WaitingNormalRelatedFormset, self).clean()
+        class WaitingOtherRelatedFormset(OtherRelatedFormset):
+            def clean(self):
+                barrier.wait()
+                return super(WaitingOtherRelatedFormset, self).clean()
+        klass = compoundformset_factory(
+            OrderedDict((
+                ('normalrel', WaitingNormalRelatedFormset),
+                ('otherrel', WaitingOtherRelatedFormset),
+            )),
+            base=CompoundInlineFormSet,
+            formset_group_fields=OrderedDict((
+                ('common', CharField(max_length=255, required=False)),
+            )),
+        )
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[2])
+        instances = {'normalrel': normal, 'otherrel': other}
+        data = FormData(klass(instances=instances))
+        formset = klass(instances=instances, data=data)
+        formset.validation_executor = self
+        self.assertTrue(self.run_async(formset.ais_valid()))
+        self.assertFalse(barrier.broken)
@@ -0,0 +1,108 @@
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from compound_forms.datastructures import LazyOrderedDict, LRUCache, OverlayDict
+
+from .utils import TestCase
+
+
+class OverlayDictTests(TestCase):
+    """ Overlays layer values on top of a shared payload without copying it """
+    def test_overlay_querydict(self):
+        data = QueryDict('a=1&b=2&b=3')
+        overlay = OverlayDict(data)
+        overlay.setlist('a', ['4'])
+        overlay['c'] = '5'
+
+        # Overridden and added keys are read from the overlay
+        self.assertEqual(overlay['a'], '4')
+        self.assertEqual(overlay.get('c'), '5')
+        self.assertEqual(overlay.getlist('a'), ['4'])
+        # Other keys fall through to the wrapped data
+        self.assertEqual(overlay['b'], '3')
+        self.assertEqual(overlay.getlist('b'), ['2', '3'])
+        self.assertIsNone(overlay.get('d'))
+        self.assertEqual(overlay.getlist('d'), [])
+        self.assertRaises(KeyError, overlay.__getitem__, 'd')
+
+        self.assertTrue('b' in overlay)
+        self.assertTrue('c' in overlay)
+        self.assertFalse('d' in overlay)
+        self.assertEqual(len(overlay), 3)
+        self.assertCountEqual(overlay.keys(), ('a', 'b', 'c'))
+        self.assertCountEqual(overlay.lists(), (('a', ['4']), ('b', ['2', '3']), ('c', ['5'])))
+
+        # Returned lists are copies, appending goes to the overlay
+        overlay.getlist('a').append('6')
+        self.assertEqual(overlay.getlist('a'), ['4'])
+        overlay.appendlist('b', '6')
+        self.assertEqual(overlay.getlist('b'), ['2', '3', '6'])
+        self.assertEqual(data.getlist('b'), ['2', '3'])
+        overlay.setlist('b', ['2', '3'])
+
+        # The wrapped data is left untouched
+        self.assertEqual(data.getlist('a'), ['1'])
+        self.assertFalse('c' in data)
+
+        # Copies are standalone
+        result = overlay.copy()
+        self.assertIsInstance(result, MultiValueDict)
+        self.assertNotIsInstance(result, OverlayDict)
+        self.assertEqual(result.getlist('b'), ['2', '3'])
+        self.assertEqual(result['a'], '4')
+
+    def test_overlay_dict(self):
+        data = {'a': '1', 'b': ['2', '3']}
+        overlay = OverlayDict(data)
+        overlay.setlist('a', ['4'])
+
+        self.assertEqual(overlay['a'], '4')
+        self.assertEqual(overlay.getlist('a'), ['4'])
+        self.assertEqual(overlay['b'], ['2', '3'])
+        self.assertEqual(overlay.getlist('b'), ['2', '3'])
+        self.assertEqual(data['a'], '1')
+
+
+class LazyOrderedDictTests(TestCase):
+    """ Lazy dicts build their values on first access """
+    def test_lazy_build(self):
+        calls = []
+        def factory(key):
+            calls.append(key)
+            return key.upper()
+        lazy = LazyOrderedDict(('b', 'a', 'c'), factory)
+
+        self.assertEqual(tuple(lazy), ('b', 'a', 'c'))
+        self.assertEqual(len(lazy), 3)
+        self.assertTrue('a' in lazy)
+        self.assertFalse('d' in lazy)
+        self.assertEqual(calls, [])
+
+        self.assertEqual(lazy['c'], 'C')
+        self.assertEqual(lazy['c'], 'C')
+        self.assertEqual(calls, ['c'])
+        self.assertRaises(KeyError, lazy.__getitem__, 'd')
+        self.assertTrue(lazy.is_built('c'))
+        self.assertFalse(lazy.is_built('a'))
+
+        self.assertEqual(lazy['a'], 'A')
+        self.assertEqual(list(lazy.built().items()), [('a', 'A'), ('c', 'C')])
+        self.assertEqual(list(lazy.values()), ['B', 'A', 'C'])
+        self.assertEqual(calls, ['c', 'a', 'b'])
+
+
+class LRUCacheTests(TestCase):
+    """ LRU caches drop least recently used items when full """
+    def test_lru_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)     # b is now least recently used
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
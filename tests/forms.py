@@ -1,12 +1,21 @@
-from django.forms import CharField
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.forms import (CharField, ChoiceField, Form, IntegerField, ModelChoiceField,
+                          Select, SplitDateTimeField)
 from collections import OrderedDict
-from compound_forms.forms import (MergingProxyForm, MergingCompoundModelForm,
-                                  compoundform_factory)
-
-from app.models import Normal, Other
-from app.forms import NormalForm, OtherForm
-from .data import NORMAL, OTHER
-from .fixtures import NormalFixture, OtherFixture
+import json
+import threading
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:     # python 2 without futures backport
+    ThreadPoolExecutor = None
+from compound_forms.forms import (MergingProxyForm, CompoundModelForm, MergingCompoundForm,
+                                  MergingCompoundModelForm, compoundform_factory,
+                                  clear_factory_cache, clone_field, media_cache)
+
+from app.models import Normal, NormalRelated, Other
+from app.forms import NormalForm, NormalRelatedForm, OtherForm
+from .data import NORMAL, NORMALREL, OTHER
+from .fixtures import NormalFixture, NormalRelatedFixture, OtherFixture
 from .formdata import FormData
 from .utils import TestCase
 
@@ -156,6 +165,36 @@ class BasicCompoundFormTest(NormalFixture, OtherFixture, TestCase):
         self.assertEqual(form.forms['normal'].prefix, 'normal')
         self.assertEqual(form.forms['other'].prefix, 'other')
 
+    def test_basic_compound_layout(self):
+        """ Alias layout is compiled once per class and shared by instances """
+        form_klass = compoundform_factory(
+            OrderedDict((('normal', NormalForm), ('other', OtherForm))),
+            base=MergingCompoundModelForm,
+        )
+        form1, form2 = form_klass(), form_klass()
+        layout = form_klass._field_layout
+        self.assertIs(form1._get_field_layout(), layout)
+        self.assertIs(form2._get_field_layout(), layout)
+        self.assertEqual(layout.aliases['other.common'], ('other', 'common'))
+        self.assertIs(form2.fields['other.common'], form2.forms['other'].fields['common'])
+        self.assertIsNot(form1.fields['other.common'], form2.fields['other.common'])
+
+    def test_basic_compound_layout_dynamic(self):
+        """ Subforms altering their fields at runtime do not use the layout """
+        class DynamicOtherForm(OtherForm):
+            def __init__(self, *args, **kwargs):
+                super(DynamicOtherForm, self).__init__(*args, **kwargs)
+                self.fields['extra'] = CharField(required=False)
+
+        form = compoundform_factory(
+            OrderedDict((('normal', NormalForm), ('other', DynamicOtherForm))),
+            base=MergingCompoundModelForm,
+        )()
+        self.assertCountEqual(form.fields,
+                              ('normal.common', 'normal.field_a',
+                               'other.common', 'other.field_a', 'other.extra'))
+        self.assertIs(form.fields['other.extra'], form.forms['other'].fields['extra'])
+
     def test_basic_compound_initial(self):
         """ Initialize the form with an instance on Normal and no Other """
         normal = Normal.objects.get(pk=self.normal_id[1])
@@ -170,6 +209,18 @@ class BasicCompoundFormTest(NormalFixture, OtherFixture, TestCase):
         self.assertEqual(form.forms['other']['common'].value(), None)
         self.assertEqual(form.forms['other']['field_a'].value(), None)
 
+    def test_basic_compound_initial_partition(self):
+        """ Initial values are given either by alias or per form """
+        for initial in ({'normal.field_a': 'a', 'other.field_a': 'b', 'other.common': 'c'},
+                        {'normal': {'field_a': 'a'}, 'other': {'field_a': 'b', 'common': 'c'}},
+                        {'normal': {'field_a': 'a'}, 'other.field_a': 'b', 'other.common': 'c'}):
+            form = self._get_form(initial=initial)
+            self.assertEqual(form['normal.field_a'].value(), 'a')
+            self.assertEqual(form['normal.common'].value(), None)
+            self.assertEqual(form['other.field_a'].value(), 'b')
+            self.assertEqual(form['other.common'].value(), 'c')
+            self.assertEqual(form.forms['other'].initial, {'field_a': 'b', 'common': 'c'})
+
     def test_basic_compound_validate(self):
         """ Update a Normal and create a new Other in one submission """
         normal = Normal.objects.get(pk=self.normal_id[1])
@@ -199,6 +250,31 @@ class BasicCompoundFormTest(NormalFixture, OtherFixture, TestCase):
         self.assertEqual(result['other'].common, 'created_oc')
         self.assertEqual(result['other'].field_a, 'created_ofa')
 
+    def test_basic_compound_save_bulk(self):
+        """ Bulk saving gives the same result in a single transaction """
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        form = self._get_form(instances={'normal': normal})
+        data = FormData(form)
+        data.set_form_field(form, 'normal.common', 'updated_nc')
+        data.set_form_field(form, 'other.common', 'created_oc')
+        data.set_form_field(form, 'other.field_a', 'created_ofa')
+
+        form = self._get_form(instances={'normal': normal}, data=data)
+        self.assertTrue(form.is_valid())
+        result = form.save(bulk=True)
+        self.assertEqual(tuple(result.keys()), ('normal', 'other'))
+        self.assertIs(result['normal'], normal)
+        self.assertEqual(Normal.objects.get(pk=self.normal_id[1]).common, 'updated_nc')
+        self.assertEqual(Other.objects.get(pk=result['other'].pk).field_a, 'created_ofa')
+
+
+class RuntimeLinkedSubForm(Form):
+    field_b = CharField()
+
+    def __init__(self, *args, **kwargs):
+        super(RuntimeLinkedSubForm, self).__init__(*args, **kwargs)
+        self.fields['common'] = CharField(initial='from_b')
+
 
 class LinkedCompoundFormTest(NormalFixture, OtherFixture, TestCase):
     """ Compound forms with linked fields """
@@ -211,6 +287,7 @@ class LinkedCompoundFormTest(NormalFixture, OtherFixture, TestCase):
             linked_fields=OrderedDict((('common', CharField(max_length=255, required=False)),)),
             base=MergingCompoundModelForm,
         )
+        form.check_linked_initials = kwargs.pop('check_linked_initials', True)
         return form(**kwargs)
 
     def test_linked_compound_create(self):
@@ -233,19 +310,39 @@ class LinkedCompoundFormTest(NormalFixture, OtherFixture, TestCase):
         self.assertEqual(form['common'].value(), NORMAL[1].common)
 
         # With mismatched linked fields, ValueError should be raised
-        with self.assertRaises(ValueError):
+        with self.assertRaises(ValueError) as context:
             form = self._get_form(instances={'normal': normal})
+        self.assertIn('common', str(context.exception))
+        self.assertIn(repr(NORMAL[1].common), str(context.exception))
+
+        # Unless checks are disabled, using the first subform's value
+        form = self._get_form(instances={'normal': normal}, check_linked_initials=False)
+        self.assertEqual(form['common'].value(), NORMAL[1].common)
 
         # Specifiying an initial value manually should bypass pulling
         form = self._get_form(instances={'normal': normal},
                               initial={'common': 'common_force'})
         self.assertEqual(form['common'].value(), 'common_force')
 
+        # Per form initial values of linked fields are pulled
+        form = self._get_form(initial={'normal': {'common': 'nested'},
+                                       'other': {'common': 'nested'}})
+        self.assertEqual(form['common'].value(), 'nested')
+        self.assertEqual(form.forms['other'].initial, {'common': 'nested'})
+
         # Linked field should shadow subform's fields, including initial setting
         with self.assertRaises(ValueError):
             form = self._get_form(instances={'normal': normal},
                                   initial={'other.common': NORMAL[1].common})
 
+    def test_linked_compound_initial_runtime_field(self):
+        """ Linked fields added by a subform at runtime are pulled """
+        klass = compoundform_factory(
+            OrderedDict((('a', MediaSubForm), ('b', RuntimeLinkedSubForm))),
+            linked_fields=OrderedDict((('common', CharField(required=False)),)),
+        )
+        self.assertEqual(klass()['common'].value(), 'from_b')
+
     def test_linked_compound_validate_correct(self):
         """ Update a Normal and create a new Other in one submission """
         normal = Normal.objects.get(pk=self.normal_id[1])
@@ -302,3 +399,479 @@ class LinkedCompoundFormTest(NormalFixture, OtherFixture, TestCase):
         # Check changed data
         self.assertTrue(form.has_changed())
         self.assertCountEqual(form.changed_data, ('common',))
+
+
+class LazyCompoundFormTest(NormalFixture, OtherFixture, TestCase):
+    """ Compound forms can construct their subforms on demand """
+    normal_count = 1
+    other_count = 1
+
+    def _get_form(self, **kwargs):
+        form = compoundform_factory(
+            OrderedDict((('normal', NormalForm), ('other', OtherForm))),
+            linked_fields=OrderedDict((('common', CharField(max_length=255, required=False)),)),
+            base=CompoundModelForm,
+        )
+        form.lazy_forms = True
+        return form(**kwargs)
+
+    def test_lazy_compound_create(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        form = self._get_form(instances={'normal': normal}, initial={'common': 'common_force'})
+        self.assertEqual(tuple(form.forms.keys()), ('normal', 'other'))
+        self.assertFalse(form.forms.is_built('normal'))
+        self.assertFalse(form.forms.is_built('other'))
+
+        self.assertEqual(form.forms['normal']['field_a'].value(), NORMAL[1].field_a)
+        self.assertTrue(form.forms.is_built('normal'))
+        self.assertFalse(form.forms.is_built('other'))
+
+    def test_lazy_compound_validate(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        form = self._get_form(instances={'normal': normal, 'other': other})
+        data = FormData(form)
+        data.update(FormData(form.forms['normal']))
+        data['common'] = 'updated_common'
+
+        # Subforms constructed after validation still get linked field values
+        form = self._get_form(instances={'normal': normal, 'other': other}, data=data)
+        self.assertTrue(form.is_valid())
+        self.assertFalse(form.forms.is_built('normal'))
+        self.assertTrue(form.forms['normal'].is_valid())
+        self.assertEqual(form.forms['normal'].cleaned_data['common'], 'updated_common')
+
+        # Only constructed subforms are saved
+        result = form.save()
+        self.assertEqual(tuple(result.keys()), ('normal',))
+        self.assertFalse(form.forms.is_built('other'))
+        self.assertEqual(Normal.objects.get(pk=self.normal_id[1]).common, 'updated_common')
+        self.assertEqual(Other.objects.get(pk=self.other_id[1]).common, OTHER[1].common)
+
+
+class SkipUnchangedCompoundFormTest(NormalFixture, OtherFixture, TestCase):
+    """ Unchanged subforms can be left out of validation and saving """
+    normal_count = 1
+    other_count = 1
+
+    def _get_form(self, **kwargs):
+        form = compoundform_factory(
+            OrderedDict((('normal', NormalForm), ('other', OtherForm))),
+            linked_fields=OrderedDict((('common', CharField(max_length=255, required=False)),)),
+            base=MergingCompoundModelForm,
+        )
+        form.skip_unchanged_forms = ('normal', 'other')
+        return form(**kwargs)
+
+    def test_skip_unchanged_validate(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        form = self._get_form(instances={'normal': normal, 'other': other})
+        data = FormData(form)
+        data.set_form_field(form, 'other.field_a', 'updated_ofa')
+
+        form = self._get_form(instances={'normal': normal, 'other': other}, data=data)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.skipped_forms, set(['normal']))
+        self.assertEqual(form.cleaned_data['normal.field_a'], NORMAL[1].field_a)
+        self.assertEqual(form.cleaned_data['other.field_a'], 'updated_ofa')
+
+        # Skipped subforms are not saved
+        Normal.objects.filter(pk=self.normal_id[1]).update(field_a='concurrent')
+        result = form.save()
+        self.assertIs(result['normal'], normal)
+        self.assertEqual(Normal.objects.get(pk=self.normal_id[1]).field_a, 'concurrent')
+        self.assertEqual(Other.objects.get(pk=self.other_id[1]).field_a, 'updated_ofa')
+
+    def test_skip_unchanged_linked(self):
+        """ Linked field changes make all sharing subforms changed """
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        form = self._get_form(instances={'normal': normal, 'other': other})
+        data = FormData(form)
+        data.set_form_field(form, 'common', '')
+
+        form = self._get_form(instances={'normal': normal, 'other': other}, data=data)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.skipped_forms, set())
+        self.assertCountEqual(form.errors, ('common',))
+
+
+class PartialBindingCompoundFormTest(NormalFixture, OtherFixture, TestCase):
+    """ Subforms absent from submitted data can be left unbound or omitted """
+    normal_count = 1
+    other_count = 1
+
+    def _get_form(self, partial_binding, **kwargs):
+        form = compoundform_factory(
+            OrderedDict((('normal', NormalForm), ('other', OtherForm))),
+            linked_fields=OrderedDict((('common', CharField(max_length=255, required=False)),)),
+            base=MergingCompoundModelForm,
+        )
+        form.partial_binding = partial_binding
+        return form(**kwargs)
+
+    def _get_data(self, form):
+        data = FormData(form.forms['other'])
+        data.set_form_field(form.forms['other'], 'field_a', 'updated_ofa')
+        data.set_form_field(form, 'common', OTHER[1].common)
+        return data
+
+    def test_partial_binding_invalid(self):
+        self.assertRaises(ValueError, self._get_form, 'skipped', data={})
+
+    def test_partial_binding_unbound(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        form = self._get_form('unbound', instances={'normal': normal, 'other': other})
+        data = self._get_data(form)
+
+        form = self._get_form('unbound', instances={'normal': normal, 'other': other},
+                              data=data)
+        self.assertFalse(form.forms['normal'].is_bound)
+        self.assertTrue(form.forms['other'].is_bound)
+        self.assertTrue(form.is_valid())
+        self.assertCountEqual(form.cleaned_data, ('common', 'other.field_a'))
+        self.assertNotIn('normal.field_a', form.changed_data)
+
+        result = form.save()
+        self.assertEqual(tuple(result.keys()), ('other',))
+        self.assertEqual(Other.objects.get(pk=self.other_id[1]).field_a, 'updated_ofa')
+
+    def test_partial_binding_skip(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[1])
+        form = self._get_form('skip', instances={'normal': normal, 'other': other})
+        self.assertEqual(tuple(form.forms.keys()), ('normal', 'other'))
+        data = self._get_data(form)
+
+        form = self._get_form('skip', instances={'normal': normal, 'other': other},
+                              data=data)
+        self.assertEqual(tuple(form.forms.keys()), ('other',))
+        self.assertCountEqual(form.fields, ('common', 'other.field_a'))
+        self.assertTrue(form.is_valid())
+        self.assertEqual(tuple(form.save().keys()), ('other',))
+
+
+class CloneFieldTest(TestCase):
+    """ Linked fields are cloned for each form instance """
+    def test_clone_field(self):
+        field = CharField(max_length=255)
+        field.widget.attrs['class'] = 'linked'
+        clone = clone_field(field)
+        self.assertIsNot(clone, field)
+        self.assertIsNot(clone.widget, field.widget)
+        self.assertEqual(clone.widget.attrs, field.widget.attrs)
+        self.assertEqual(clone.validators, field.validators)
+
+        clone.widget.attrs['class'] = 'changed'
+        clone.validators.append(lambda value: None)
+        self.assertEqual(field.widget.attrs['class'], 'linked')
+        self.assertEqual(len(clone.validators), len(field.validators) + 1)
+
+    def test_clone_choice_field(self):
+        field = ChoiceField(choices=[('a', 'A'), ('b', 'B')])
+        clone = clone_field(field)
+        self.assertEqual(clone.choices, field.choices)
+        clone.choices.append(('c', 'C'))
+        self.assertEqual(len(field.choices), 2)
+        self.assertIs(clone.choices[0], field.choices[0])   # entries are shared
+
+    def test_clone_widget_choices(self):
+        field = CharField(widget=Select(choices=[('a', 'A'), ('b', 'B')]))
+        clone = clone_field(field)
+        self.assertEqual(clone.widget.choices, field.widget.choices)
+        clone.widget.choices.append(('c', 'C'))
+        self.assertEqual(len(field.widget.choices), 2)
+
+    def test_clone_field_fallback(self):
+        """ Fields and widgets with their own deepcopy are deep-copied """
+        for field in (ModelChoiceField(queryset=Normal.objects.all()), SplitDateTimeField()):
+            clone = clone_field(field)
+            self.assertIsNot(clone.widget, field.widget)
+            self.assertEqual(type(clone.widget), type(field.widget))
+
+
+class MediaSubForm(Form):
+    field_a = CharField()
+    class Media:
+        js = ('common.js', 'a.js')
+
+class OtherMediaSubForm(Form):
+    field_b = CharField()
+    class Media:
+        js = ('common.js', 'b.js')
+
+
+class MediaCompoundFormTest(TestCase):
+    """ Merged media can be computed once per classes """
+    def setUp(self):
+        media_cache.clear()
+        self.form_class = compoundform_factory(
+            OrderedDict((('a', MediaSubForm), ('b', OtherMediaSubForm))),
+        )
+
+    def _get_proxy_form(self, forms):
+        form = MergingProxyForm(forms=forms)
+        form.cache_media = True
+        return form
+
+    def test_media_cached(self):
+        self.form_class.cache_media = True
+        media = self.form_class().media
+        self.assertEqual(media._js, ['common.js', 'a.js', 'b.js'])
+        self.assertIs(self.form_class().media, media)
+        self.assertEqual(len(media_cache), 1)
+
+        # proxy forms are keyed by subform classes
+        forms = {'a': MediaSubForm(prefix='a'), 'b': OtherMediaSubForm(prefix='b')}
+        self.assertEqual(self._get_proxy_form(forms).media._js, media._js)
+        self.assertEqual(len(media_cache), 2)
+        self._get_proxy_form({'a': MediaSubForm(prefix='a')}).media
+        self.assertEqual(len(media_cache), 3)
+
+    def test_media_uncached(self):
+        """ Caching is opt-in """
+        media = self.form_class().media
+        self.assertEqual(media._js, ['common.js', 'a.js', 'b.js'])
+        self.assertIsNot(self.form_class().media, media)
+        self.assertEqual(len(media_cache), 0)
+
+
+class FailingSubForm(Form):
+    code = CharField()
+    common = CharField(required=False)
+
+    def clean(self):
+        raise ValidationError(['Shared failure.', 'Failure of %s.' % self.prefix])
+
+
+class MergedErrorsTest(TestCase):
+    """ Subform errors are merged on access, in order """
+    def _get_form(self):
+        klass = compoundform_factory(
+            OrderedDict((('first', FailingSubForm), ('second', FailingSubForm))),
+            linked_fields=OrderedDict((('common', CharField(max_length=3, required=False)),)),
+            base=MergingCompoundForm,
+        )
+        return klass(data={'first-code': 'a', 'common': 'toolong'})
+
+    def test_merged_errors(self):
+        form = self._get_form()
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form._errors._merged, {})      # nothing merged yet
+
+        self.assertEqual(list(form.errors.keys()), ['common', '__all__', 'second.code'])
+        self.assertEqual(len(form.errors), 3)
+        self.assertEqual(form.errors['second.code'], form.forms['second'].errors['code'])
+        self.assertIsNot(form.errors['second.code'], form.forms['second'].errors['code'])
+        self.assertNotIn('first.code', form.errors)
+        self.assertEqual(form.non_field_errors(),
+                         ['Shared failure.', 'Failure of first.', 'Failure of second.'])
+        self.assertEqual(len(form.errors['common']), 1)
+        self.assertIn('Failure of second.', form.errors.as_ul())
+
+    def test_merged_errors_json(self):
+        """ Merged errors are seen by code reading the dict directly """
+        form = self._get_form()
+        self.assertFalse(form.is_valid())
+        self.assertEqual(sorted(json.loads(json.dumps(form.errors))),
+                         ['__all__', 'common', 'second.code'])
+        self.assertEqual(dict(form.errors.copy()), dict(form.errors.items()))
+
+    def test_merged_errors_add(self):
+        form = self._get_form()
+        form.is_valid()
+        form.add_error('first.code', 'Added.')
+        self.assertEqual(form.errors['first.code'], ['Added.'])
+        form.add_error('second.code', 'Added.')
+        self.assertEqual(form.errors['second.code'][-1], 'Added.')
+        self.assertNotIn('Added.', form.forms['second'].errors['code'])
+        form.add_error(None, 'Added.')
+        self.assertEqual(form.non_field_errors()[-1], 'Added.')
+
+
+class MergedCleanedDataTest(TestCase):
+    """ Subform cleaned_data is read through, not copied """
+    def test_merged_cleaned_data(self):
+        klass = compoundform_factory(
+            OrderedDict((('first', MediaSubForm), ('second', OtherMediaSubForm))),
+            linked_fields=OrderedDict((('common', CharField(required=False)),)),
+            base=MergingCompoundForm,
+        )
+        form = klass(data={'common': 'c', 'first-field_a': 'a', 'second-field_b': 'b'})
+        self.assertTrue(form.is_valid())
+        cleaned_data = form.cleaned_data
+        self.assertEqual(list(cleaned_data), ['common', 'first.field_a', 'second.field_b'])
+        self.assertEqual(len(cleaned_data), 3)
+        self.assertEqual(cleaned_data.copy(),
+                         {'common': 'c', 'first.field_a': 'a', 'second.field_b': 'b'})
+
+        value = form.forms['second'].cleaned_data['field_b'] = object()
+        self.assertIs(cleaned_data['second.field_b'], value)
+
+        cleaned_data['first.field_a'] = 'overridden'
+        self.assertEqual(cleaned_data['first.field_a'], 'overridden')
+        self.assertEqual(form.forms['first'].cleaned_data['field_a'], 'a')
+        del cleaned_data['first.field_a']
+        self.assertNotIn('first.field_a', cleaned_data)
+        self.assertEqual(dict(cleaned_data), {'common': 'c', 'second.field_b': value})
+
+    def test_own_fields(self):
+        """ Only own fields are cleaned, fields changed later once reset """
+        seen = []
+        class OwnFieldsForm(MergingCompoundForm):
+            form_classes = OrderedDict((('first', MediaSubForm),))
+            own = CharField()
+            def clean_own(self):
+                seen.append(tuple(self.fields))
+                return self.cleaned_data['own']
+
+        form = OwnFieldsForm(data={'own': 'o', 'extra': 'e', 'first-field_a': 'a'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(seen, [('own',)])
+        self.assertEqual(tuple(form.fields), ('own', 'first.field_a'))
+        form.fields['extra'] = CharField()
+        form.reset_own_fields()
+        form.full_clean()
+        self.assertEqual(form.cleaned_data['extra'], 'e')
+        form.fields['extra'] = IntegerField()   # replaced fields are used too
+        form.reset_own_fields()
+        form.full_clean()
+        self.assertIn('extra', form.errors)
+
+
+class LoadInstancesTest(NormalRelatedFixture, NormalFixture, TestCase):
+    """ Subform instances can be loaded from a root object """
+    normal_count = 1
+    normalrel_count = 1
+
+    def _get_form_class(self):
+        klass = compoundform_factory(
+            OrderedDict((('normalrel', NormalRelatedForm), ('normal', NormalForm))),
+            base=MergingCompoundModelForm,
+        )
+        klass.root_model = NormalRelated
+        klass.instance_relations = {'normalrel': '', 'normal': 'normal'}
+        return klass
+
+    def test_load_instances(self):
+        klass = self._get_form_class()
+        for root in (self.normalrel_id[1], NormalRelated.objects.get(pk=self.normalrel_id[1])):
+            with self.assertNumQueries(1):
+                instances, query_count = klass.load_instances(root)
+            self.assertEqual(query_count, 1)
+            self.assertEqual(instances['normalrel'].pk, self.normalrel_id[1])
+            self.assertEqual(instances['normal'].pk, self.normal_id[1])
+
+            with self.assertNumQueries(0):
+                form = klass(instances=instances)
+                self.assertEqual(form['normal.field_a'].value(), NORMAL[1].field_a)
+                self.assertEqual(form['normalrel.field_a'].value(), NORMALREL[1].field_a)
+
+    def test_load_instances_missing(self):
+        klass = self._get_form_class()
+        NormalRelated.objects.filter(pk=self.normalrel_id[1]).update(normal=None)
+        instances, query_count = klass.load_instances(self.normalrel_id[1])
+        self.assertEqual(query_count, 1)
+        self.assertCountEqual(instances, ('normalrel',))
+
+    def test_load_instances_root(self):
+        """ A root object is used as is if no relation must be loaded """
+        klass = self._get_form_class()
+        klass.instance_relations = {'normalrel': ''}
+        root = NormalRelated.objects.get(pk=self.normalrel_id[1])
+        with self.assertNumQueries(0):
+            instances, query_count = klass.load_instances(root)
+        self.assertEqual(query_count, 0)
+        self.assertIs(instances['normalrel'], root)
+
+    def test_load_instances_unconfigured(self):
+        klass = self._get_form_class()
+        klass.root_model = None
+        self.assertRaises(ImproperlyConfigured, klass.load_instances, self.normalrel_id[1])
+
+
+class FactoryCacheTest(TestCase):
+    """ Factory-built classes can be memoized """
+    def tearDown(self):
+        clear_factory_cache()
+
+    def test_factory_cache(self):
+        forms = OrderedDict((('normal', NormalForm), ('other', OtherForm)))
+        linked_fields = OrderedDict((('common', CharField(max_length=255, required=False)),))
+
+        klass = compoundform_factory(forms, linked_fields=linked_fields, cache=True)
+        self.assertIs(compoundform_factory(forms.copy(), linked_fields=linked_fields.copy(),
+                                           cache=True), klass)
+        # Any differing argument gives another class
+        self.assertIsNot(compoundform_factory(forms, cache=True), klass)
+        self.assertIsNot(compoundform_factory(forms, linked_fields=linked_fields,
+                                              base=MergingCompoundModelForm, cache=True), klass)
+        self.assertIsNot(compoundform_factory(forms, linked_fields=OrderedDict((
+            ('common', CharField(max_length=255, required=False)),
+        )), cache=True), klass)
+        # Caching is opt-in
+        self.assertIsNot(compoundform_factory(forms, linked_fields=linked_fields), klass)
+
+        clear_factory_cache()
+        self.assertIsNot(compoundform_factory(forms, linked_fields=linked_fields,
+                                              cache=True), klass)
+
+
+class ConcurrentCompoundFormTest(TestCase):
+    """ Subforms can be validated concurrently by an executor """
+    class ValidatedForm(Form):
+        code = CharField(max_length=4)
+        def clean_code(self):
+            self.thread = threading.current_thread()
+            if self.cleaned_data['code'].startswith('x'):
+                raise ValidationError('Invalid code')
+            return self.cleaned_data['code']
+
+    class RecordingExecutor(object):
+        """ Executor running calls immediately, from the calling thread """
+        class Future(object):
+            def __init__(self, value):
+                self.value = value
+            def result(self):
+                return self.value
+        def __init__(self):
+            self.calls = 0
+        def submit(self, function, *args, **kwargs):
+            self.calls += 1
+            return self.Future(function(*args, **kwargs))
+
+    def _get_form(self, **kwargs):
+        form = compoundform_factory(
+            OrderedDict((name, self.ValidatedForm) for name in ('first', 'second', 'third')),
+            linked_fields=OrderedDict((('common', CharField(max_length=255)),)),
+        )
+        return form(**kwargs)
+
+    def _get_data(self):
+        return {'common': 'common', 'first-code': 'a1', 'second-code': 'x2',
+                'third-code': 'toolong', 'first-common': 'ignored'}
+
+    def test_concurrent_executor(self):
+        executor = self.RecordingExecutor()
+        form = self._get_form(data=self._get_data(), validation_executor=executor)
+        serial = self._get_form(data=self._get_data())
+        self.assertFalse(form.is_valid())
+        self.assertEqual(executor.calls, 3)
+        self.assertEqual(form.errors, serial.errors)
+        self.assertEqual(list(form.errors.keys()), list(serial.errors.keys()))
+        self.assertEqual(form.cleaned_data, serial.cleaned_data)
+
+    def test_concurrent_threads(self):
+        if ThreadPoolExecutor is None:
+            self.skipTest('concurrent.futures is not available')
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            form = self._get_form(data=self._get_data(), validation_executor=executor)
+            self.assertFalse(form.is_valid())
+        serial = self._get_form(data=self._get_data())
+        self.assertEqual(form.errors, serial.errors)
+        self.assertCountEqual(form.errors, ('second.code', 'third.code'))
+        self.assertTrue(all(subform.thread is not threading.current_thread()
+                            for subform in form.forms.values()
+                            if hasattr(subform, 'thread')))
@@ -1,11 +1,14 @@
+from django.core.exceptions import ValidationError
 from django.forms import CharField
+from django.forms.formsets import formset_factory
 from collections import OrderedDict
+from compound_forms.forms import clear_factory_cache
 from compound_forms.formsets import (ProxyFormSet, CompoundInlineFormSet,
                                      InvalidFormsetsError, compoundformset_factory)
 
 from app.models import Normal, Other
-from app.forms import (NormalFormset, NormalRelatedFormset,
-                       OtherFormset, OtherRelatedFormset)
+from app.forms import (NormalForm, NormalFormset, NormalRelatedFormset,
+                       OtherForm, OtherFormset, OtherRelatedFormset)
 from .data import NORMAL, NORMALREL, OTHER, OTHERREL
 from .fixtures import (NormalFixture, NormalRelatedFixture,
                        OtherFixture, OtherRelatedFixture)
@@ -58,6 +61,88 @@ class ProxyFormSetTests(NormalFixture, OtherFixture, TestCase):
             self.assertCountEqual(form.forms, ('normal', 'other'))
 
 
+    def test_proxy_shared_layout(self):
+        """ Rows share a single field layout """
+        formset = self._get_formset(NormalFormset(queryset=Normal.objects.order_by('id')),
+                                    OtherFormset())
+        first, second = formset.forms[:2]
+        self.assertIs(first.field_form.aliases, second.field_form.aliases)
+        self.assertIs(first.linked_fields, second.linked_fields)
+        self.assertIsNot(first['normal.field_a'].form, second['normal.field_a'].form)
+        self.assertEqual(second['normal.field_a'].value(), NORMAL[2].field_a)
+        self.assertCountEqual(second.field_form, ('normal.id', 'normal.field_a',
+                                                  'other.id', 'other.field_a'))
+
+    def test_proxy_render_stream(self):
+        """ Streamed rendering builds rows one at a time, with the same output """
+        normal, other = NormalFormset(queryset=Normal.objects.order_by('id')), OtherFormset()
+        formset = self._get_formset(normal, other)
+        stream = formset.render_stream('as_p')
+        chunks = list(stream)
+        self.assertEqual(len(chunks), 1 + self.item_count + NormalFormset.extra)
+        self.assertNotIn('forms', formset.__dict__)
+        self.assertNotIn('forms', normal.__dict__)
+        self.assertNotIn('forms', other.__dict__)
+
+        formset = self._get_formset(NormalFormset(queryset=Normal.objects.order_by('id')),
+                                    OtherFormset())
+        self.assertEqual(''.join(chunks), formset.as_p())
+        # once built, rows are reused
+        self.assertEqual(''.join(formset.render_stream('as_p')), formset.as_p())
+
+    def test_proxy_management_form(self):
+        """ Management form is built once, and again when the formset is rebound """
+        formset = self._get_formset(NormalFormset(queryset=Normal.objects.order_by('id'),
+                                                  prefix='normal'),
+                                    OtherFormset(prefix='other'))
+        self.assertIs(formset.management_form, formset.management_form)
+
+        data = FormData(formset)
+        formset = self._get_formset(NormalFormset(data=data, prefix='normal'),
+                                    OtherFormset(data=data, prefix='other'),
+                                    data=data)
+        form = formset.management_form
+        self.assertIs(formset.management_form, form)
+        formset.data = data.copy()
+        self.assertIsNot(formset.management_form, form)
+        self.assertIs(formset.management_form, formset.management_form)
+
+        # Invalid management data raises on every access
+        data.pop(formset.management_form['normal.TOTAL_FORMS'].html_name)
+        formset = self._get_formset(NormalFormset(data=data, prefix='normal'),
+                                    OtherFormset(data=data, prefix='other'),
+                                    data=data)
+        self.assertRaises(ValidationError, getattr, formset, 'management_form')
+        self.assertRaises(ValidationError, getattr, formset, 'management_form')
+
+    def test_proxy_form_counts(self):
+        """ Counts and flags are computed once, until reset """
+        normal = NormalFormset(queryset=Normal.objects.order_by('id'), prefix='normal')
+        other = OtherFormset(prefix='other')
+        formset = self._get_formset(normal, other)
+        count = formset.total_form_count()
+        initial_count = formset.initial_form_count()
+        can_delete = formset.can_delete
+        management_form = formset.management_form
+
+        normal.total_form_count = lambda: count + 1
+        normal.can_delete = not can_delete
+        self.assertEqual(formset.total_form_count(), count)
+        self.assertEqual(formset.initial_form_count(), initial_count)
+        self.assertEqual(formset.can_delete, can_delete)
+        self.assertIs(formset.management_form, management_form)
+        self.assertEqual(formset.total_form_count(), count)
+
+        # Rebinding resets them along with the management form
+        formset.data = {}
+        self.assertIsNot(formset.management_form, management_form)
+        self.assertRaises(InvalidFormsetsError, formset.total_form_count)
+
+        formset.reset_counts()
+        self.assertRaises(InvalidFormsetsError, formset.total_form_count)
+        self.assertRaises(InvalidFormsetsError, formset.total_form_count)
+        self.assertEqual(formset.can_delete, False)
+
     def test_proxy_create_invalid_number(self):
         """ Test an exception is raised if formset do not have same number of forms """
         formset = self._get_formset(NormalFormset(),
@@ -72,6 +157,18 @@ class ProxyFormSetTests(NormalFixture, OtherFixture, TestCase):
         self.assertRaises(InvalidFormsetsError, str, formset)
         #-- note: formset.is_valid() will not raise as the formset is not bound
 
+    def test_proxy_create_unmatched(self):
+        """ Test mismatched groups are reported before sub-forms are built """
+        Other.objects.filter(pk=self.other_id[2]).update(common='unmatched')
+        normal, other = NormalFormset(), OtherFormset()
+        formset = self._get_formset(normal, other)
+        with self.assertRaises(InvalidFormsetsError) as context:
+            formset.forms
+        self.assertIn(repr((NORMAL[2].common,)), str(context.exception))
+        self.assertIn(repr((u'unmatched',)), str(context.exception))
+        self.assertNotIn('forms', normal.__dict__)
+        self.assertNotIn('forms', other.__dict__)
+
     def test_proxy_create_shuffled(self):
         """ Test forms are correctly grouped despite not being in order on subformets """
         normalqs = Normal.objects.order_by('-common')
@@ -83,6 +180,11 @@ class ProxyFormSetTests(NormalFixture, OtherFixture, TestCase):
         self.assertEqual(len(formset.initial_forms), self.item_count)
         self.assertEqual(len(formset.extra_forms), NormalFormset.extra)
 
+        # groups are computed from querysets
+        self.assertEqual(list(formset._initial_group_indexes().values()),
+                         [OrderedDict((('normal', 0), ('other', 1))),
+                          OrderedDict((('normal', 1), ('other', 0)))])
+
         # for each initial form, test the grouping value is identical on all subforms
         # and that the order used is that of the first formset (NormalFormset here)
         for index, form in enumerate(formset.initial_forms):
@@ -188,6 +290,21 @@ class CompoundInlineFormSetTests(NormalRelatedFixture, NormalFixture,
         )
         return formset(**kwargs)
 
+    def test_compound_factory_cache(self):
+        formsets = OrderedDict((
+            ('normalrel', NormalRelatedFormset),
+            ('otherrel', OtherRelatedFormset),
+        ))
+        try:
+            klass = compoundformset_factory(formsets, base=CompoundInlineFormSet, cache=True)
+            self.assertIs(compoundformset_factory(formsets, base=CompoundInlineFormSet,
+                                                  cache=True), klass)
+            self.assertIsNot(compoundformset_factory(formsets, cache=True), klass)
+            self.assertIsNot(compoundformset_factory(formsets, base=CompoundInlineFormSet),
+                             klass)
+        finally:
+            clear_factory_cache()
+
     def test_compound_create(self):
         """ Test formsets are created correctly, and regular formset interface works """
         normal = Normal.objects.get(pk=self.normal_id[1])
@@ -219,6 +336,14 @@ class CompoundInlineFormSetTests(NormalRelatedFixture, NormalFixture,
         for form in formset.extra_forms:
             self.assertCountEqual(form.forms, ('normalrel', 'otherrel'))
 
+    def test_compound_create_queries(self):
+        """ Grouping initial forms reuses the querysets forms are built from """
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[2])
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other})
+        with self.assertNumQueries(2):
+            self.assertEqual(len(formset.forms), 2 + NormalRelatedFormset.extra)
+
     def test_compound_save_update(self):
         normal = Normal.objects.get(pk=self.normal_id[1])
         other = Other.objects.get(pk=self.other_id[2])
@@ -250,6 +375,79 @@ class CompoundInlineFormSetTests(NormalRelatedFixture, NormalFixture,
         self.assertEqual(orelqs[1].field_a, 'updated_fa_2')
 
 
+    def test_compound_skip_unchanged_rows(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[2])
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other})
+
+        data = FormData(formset)
+        data.set_formset_field(formset, 1, 'otherrel.field_a', 'updated_fa_2')
+
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other},
+                                    data=data)
+        formset.skip_unchanged_rows = True
+        self.assertTrue(formset.is_valid())
+        self.assertEqual(formset.forms[0].skipped_forms, set(['normalrel', 'otherrel']))
+        self.assertEqual(formset.forms[1].skipped_forms, set())
+        self.assertEqual(formset.forms[0].cleaned_data['normalrel.field_a'],
+                         NORMALREL[1].field_a)
+        formset.save()
+
+        orelqs = other.related_set.order_by('id')
+        self.assertEqual(orelqs[0].field_a, OTHERREL[1].field_a)
+        self.assertEqual(orelqs[1].field_a, 'updated_fa_2')
+
+    def test_compound_window(self):
+        """ Windowed formsets only build and save a slice of row groups """
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[2])
+        instances = {'normalrel': normal, 'otherrel': other}
+        for window in ({'offset': 1, 'limit': 1}, {'after': NORMALREL[1].common}):
+            formset = self._get_formset(instances=instances, **window)
+            self.assertEqual(formset.initial_form_count(), 1)
+            self.assertEqual(formset.total_form_count(), 2)
+            self.assertEqual(formset.forms[0]['common'].value(), NORMALREL[3].common)
+
+        data = FormData(formset)
+        data.set_formset_field(formset, 0, 'normalrel.field_a', 'updated_fa_3')
+        formset = self._get_formset(instances=instances, data=data, offset=1, limit=1)
+        self.assertTrue(formset.is_valid())
+        formset.save()
+
+        nrelqs = normal.related_set.order_by('id')
+        self.assertEqual(len(nrelqs), 2)
+        self.assertEqual(nrelqs[0].field_a, NORMALREL[1].field_a)
+        self.assertEqual(nrelqs[1].field_a, 'updated_fa_3')
+
+    def test_compound_window_initial(self):
+        """ Initial rows are windowed in group key order """
+        klass = compoundformset_factory(
+            OrderedDict((
+                ('normal', formset_factory(NormalForm, extra=0)),
+                ('other', formset_factory(OtherForm, extra=0)),
+            )),
+            formset_group_fields=OrderedDict((
+                ('common', CharField(max_length=255, required=False)),
+            )),
+        )
+        initial = [{'common': 'c'}, {'common': 'a'}, {'common': 'b'}]
+        for window, expected in (({'offset': 0, 'limit': 2}, ['a', 'b']),
+                                 ({'after': ('a',), 'limit': 1}, ['b']),
+                                 ({'after': 'a'}, ['b', 'c'])):
+            formset = klass(initial=initial, **window)
+            self.assertEqual([form['common'].value() for form in formset.initial_forms],
+                             expected)
+
+        # missing group keys default to None, which sorts first
+        initial = [{'common': 'b'}, {}, {'common': 'a'}]
+        for window, expected in (({'offset': 0, 'limit': 3}, [None, 'a', 'b']),
+                                 ({'limit': 2}, [None, 'a']),
+                                 ({'after': 'a'}, ['b']),
+                                 ({'after': (None,)}, ['a', 'b'])):
+            formset = klass(initial=initial, **window)
+            self.assertEqual([form['common'].value() for form in formset.initial_forms],
+                             expected)
+
     def test_compound_save_delete(self):
         normal = Normal.objects.get(pk=self.normal_id[1])
         other = Other.objects.get(pk=self.other_id[2])
@@ -293,3 +491,35 @@ class CompoundInlineFormSetTests(NormalRelatedFixture, NormalFixture,
         orelqs = other.related_set.order_by('id')
         self.assertEqual(len(nrelqs), 3)
         self.assertEqual(len(orelqs), 3)
+
+    def test_compound_save_bulk(self):
+        normal = Normal.objects.get(pk=self.normal_id[1])
+        other = Other.objects.get(pk=self.other_id[2])
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other})
+
+        data = FormData(formset)
+        data.set_formset_field(formset, 0, 'DELETE', 'on')
+        data.set_formset_field(formset, 1, 'normalrel.field_a', 'updated_fa_2')
+        data.set_formset_field(formset, 2, 'common', 'created_common')
+        data.set_formset_field(formset, 2, 'normalrel.field_a', 'created_nfa')
+        data.set_formset_field(formset, 2, 'otherrel.field_a', 'created_ofa')
+
+        formset = self._get_formset(instances={'normalrel': normal, 'otherrel': other},
+                                    data=data)
+
+        self.assertTrue(formset.is_valid())
+        result = formset.save(bulk=True)
+        self.assertEqual(tuple(result.keys()), ('normalrel', 'otherrel'))
+        self.assertEqual(len(result['normalrel']), 2)
+        self.assertEqual(len(result['otherrel']), 1)
+        self.assertTrue(all(instance.pk is not None
+                            for instances in result.values() for instance in instances))
+
+        nrelqs = normal.related_set.order_by('id')
+        orelqs = other.related_set.order_by('id')
+        self.assertEqual([(obj.common, obj.field_a) for obj in nrelqs],
+                         [(NORMALREL[3].common, 'updated_fa_2'),
+                          ('created_common', 'created_nfa')])
+        self.assertEqual([(obj.common, obj.field_a) for obj in orelqs],
+                         [(OTHERREL[3].common, OTHERREL[3].field_a),
+                          ('created_common', 'created_ofa')])
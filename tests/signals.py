@@ -0,0 +1,91 @@
+from django.forms import CharField
+from collections import OrderedDict
+from compound_forms.forms import MergingCompoundModelForm, compoundform_factory
+from compound_forms.formsets import CompoundInlineFormSet, compoundformset_factory
+from compound_forms.signals import phase_timed
+
+from app.models import Normal, Other
+from app.forms import NormalForm, OtherForm, NormalRelatedFormset, OtherRelatedFormset
+from .fixtures import NormalFixture, OtherFixture
+from .formdata import FormData
+from .utils import TestCase
+
+
+class PhaseTimedTests(NormalFixture, OtherFixture, TestCase):
+    """ Lifecycle phases are timed when phase_timed has receivers """
+    normal_count = 1
+    other_count = 1
+
+    def setUp(self):
+        self.events = []
+        phase_timed.connect(self.receiver)
+        super(PhaseTimedTests, self).setUp()
+
+    def tearDown(self):
+        phase_timed.disconnect(self.receiver)
+        super(PhaseTimedTests, self).tearDown()
+
+    def receiver(self, sender, instance, phase, name, duration, **kwargs):
+        self.assertIsInstance(instance, sender)
+        self.assertGreaterEqual(duration, 0)
+        self.events.append((phase, name))
+
+    def test_form_phases(self):
+        klass = compoundform_factory(
+            OrderedDict((('normal', NormalForm), ('other', OtherForm))),
+            linked_fields=OrderedDict((('common', CharField(max_length=255)),)),
+            base=MergingCompoundModelForm,
+        )
+        instances = {
+            'normal': Normal.objects.get(pk=self.normal_id[1]),
+            'other': Other.objects.get(pk=self.other_id[1]),
+        }
+        form = klass(instances=instances)
+        self.assertEqual(self.events, [
+            ('construct_form', 'normal'),
+            ('construct_form', 'other'),
+            ('pull_linked_fields', None),
+        ])
+
+        data = FormData(form)
+        del self.events[:]
+        form = klass(instances=instances, data=data)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.errors, {})
+        form.save()
+        self.assertEqual(self.events, [
+            ('construct_form', 'normal'),
+            ('construct_form', 'other'),
+            ('push_linked_fields', None),
+            ('full_clean', 'normal'),
+            ('full_clean', 'other'),
+            ('merge_errors', None),     # form.errors, once
+            ('save', 'normal'),
+            ('save', 'other'),
+        ])
+
+    def test_formset_phases(self):
+        klass = compoundformset_factory(
+            OrderedDict((('normalrel', NormalRelatedFormset), ('otherrel', OtherRelatedFormset))),
+            base=CompoundInlineFormSet,
+        )
+        instances = {
+            'normalrel': Normal.objects.get(pk=self.normal_id[1]),
+            'otherrel': Other.objects.get(pk=self.other_id[1]),
+        }
+        formset = klass(instances=instances)
+        self.assertEqual(len(formset.forms), 1)
+        self.assertEqual(self.events, [
+            ('construct_formset', 'normalrel'),
+            ('construct_formset', 'otherrel'),
+            ('pull_linked_fields', None),   # extra row
+        ])
+
+    def test_no_receivers(self):
+        phase_timed.disconnect(self.receiver)
+        klass = compoundform_factory(
+            OrderedDict((('normal', NormalForm), ('other', OtherForm))),
+            base=MergingCompoundModelForm,
+        )
+        klass().is_valid()
+        self.assertEqual(self.events, [])
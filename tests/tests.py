@@ -1,6 +1,16 @@
 import django
 if django.VERSION < (1, 6):
     from .fixtures import FixtureTests
+    from .datastructures import (OverlayDictTests, LazyOrderedDictTests,
+                                 LRUCacheTests)
     from .forms import (BasicProxyFormTest, BasicCompoundFormTest,
-                        LinkedCompoundFormTest)
-    from .formsets import (ProxyFormSetTests, CompoundInlineFormSetTests)
\ No newline at end of file
+                        LinkedCompoundFormTest, LazyCompoundFormTest,
+                        SkipUnchangedCompoundFormTest,
+                        PartialBindingCompoundFormTest, CloneFieldTest,
+                        MediaCompoundFormTest, MergedErrorsTest,
+                        MergedCleanedDataTest, LoadInstancesTest,
+                        FactoryCacheTest,
+                        ConcurrentCompoundFormTest)
+    from .formsets import (ProxyFormSetTests, CompoundInlineFormSetTests)
+    from .signals import PhaseTimedTests
+    from .aio import AsyncCompoundFormTest, AsyncCompoundInlineFormSetTest